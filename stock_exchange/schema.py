@@ -0,0 +1,136 @@
+"""
+OpenAPI schema serving for the Stock Exchange API.
+
+The schema is generated ahead of time with `manage.py generate_schema` and the
+resulting file is served as-is. drf_yasg's schema generator and UI views are
+only imported the first time they are actually needed.
+
+The file must be regenerated whenever the API changes: `generate_schema --check`
+and the deploy system check (`manage.py check --deploy`) fail on a stale file.
+"""
+import os
+
+from django.conf import settings
+from django.core.checks import Warning
+from django.http import HttpResponse
+
+_prebuilt_schema = {}
+_schema_views = {}
+
+
+def api_info():
+    """
+    Return the openapi.Info object describing this API.
+    """
+    from drf_yasg import openapi
+
+    return openapi.Info(
+        title="Stock Exchange APP",
+        default_version='v1',
+        description="Stock Exchange ",
+        contact=openapi.Contact(email="abdullahkpr22@gmail.com"),
+    )
+
+
+def generate_schema():
+    """
+    Generate the OpenAPI schema for the current views and return it as JSON bytes.
+    """
+    from drf_yasg.codecs import OpenAPICodecJson
+    from drf_yasg.generators import OpenAPISchemaGenerator
+
+    generator = OpenAPISchemaGenerator(info=api_info())
+    schema = generator.get_schema(request=None, public=True)
+    return OpenAPICodecJson(validators=[]).encode(schema)
+
+
+def check_prebuilt_schema(app_configs=None, **kwargs):
+    """
+    Deploy check: warn when the prebuilt schema file is missing or differs from the generated schema.
+    """
+    path = settings.OPENAPI_SCHEMA_FILE
+    content = load_prebuilt_schema()
+    if content is None:
+        return [Warning(
+            f"The OpenAPI schema file {path} does not exist; it will be generated on each process's first request.",
+            hint="Run `manage.py generate_schema` as part of the build.",
+            id='stock_exchange.W001',
+        )]
+    if content != generate_schema():
+        return [Warning(
+            f"The OpenAPI schema file {path} is out of date with the API.",
+            hint="Run `manage.py generate_schema` to regenerate it.",
+            id='stock_exchange.W002',
+        )]
+    return []
+
+
+def load_prebuilt_schema():
+    """
+    Return the bytes of the prebuilt schema file, or None if it has not been generated.
+    The file is re-read only when its modification time changes.
+    """
+    path = str(settings.OPENAPI_SCHEMA_FILE)
+    try:
+        mtime = os.stat(path).st_mtime
+    except FileNotFoundError:
+        return None
+
+    cached = _prebuilt_schema.get(path)
+    if cached is None or cached[0] != mtime:
+        with open(path, 'rb') as schema_file:
+            cached = (mtime, schema_file.read())
+        _prebuilt_schema[path] = cached
+    return cached[1]
+
+
+def _get_schema_view(renderer):
+    """
+    Build (once) the drf_yasg view for the given renderer: 'swagger', 'redoc' or None for raw JSON.
+    """
+    view = _schema_views.get(renderer)
+    if view is None:
+        from drf_yasg.views import get_schema_view
+        from rest_framework.permissions import AllowAny
+
+        schema_view = get_schema_view(
+            api_info(),
+            public=True,
+            permission_classes=[AllowAny],
+        )
+        cache_timeout = settings.OPENAPI_SCHEMA_CACHE_TIMEOUT
+        if renderer is None:
+            view = schema_view.without_ui(cache_timeout=cache_timeout)
+        else:
+            view = schema_view.with_ui(renderer, cache_timeout=cache_timeout)
+        _schema_views[renderer] = view
+    return view
+
+
+def schema_json(request, *args, **kwargs):
+    """
+    Serve the prebuilt OpenAPI schema, falling back to cached on-demand generation.
+    """
+    content = load_prebuilt_schema()
+    if content is None:
+        # Without a format the view negotiates on Accept and may answer with YAML.
+        kwargs['format'] = '.json'
+        return _get_schema_view(None)(request, *args, **kwargs)
+
+    response = HttpResponse(content, content_type='application/json')
+    response['Cache-Control'] = 'public, max-age=%d' % settings.OPENAPI_SCHEMA_CACHE_TIMEOUT
+    return response
+
+
+def _ui_view(renderer):
+    def view(request, *args, **kwargs):
+        # `?format=openapi` is the legacy schema URL polled by API clients.
+        if request.GET.get('format') in ('openapi', 'json'):
+            return schema_json(request)
+        return _get_schema_view(renderer)(request, *args, **kwargs)
+
+    return view
+
+
+swagger_ui = _ui_view('swagger')
+redoc_ui = _ui_view('redoc')
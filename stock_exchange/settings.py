@@ -10,7 +10,6 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 
-import psycopg2
 import os
 from datetime import timedelta
 from pathlib import Path
@@ -57,6 +56,13 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+# Query budgets declared with stock_exchange_app.querybudget.query_budget are enforced
+# while this is on; RepeatedQueryMiddleware logs statements repeated QUERY_REPEAT_THRESHOLD times.
+QUERY_BUDGET_ENFORCE = DEBUG
+QUERY_REPEAT_THRESHOLD = 3
+if DEBUG:
+    MIDDLEWARE.append('stock_exchange_app.querybudget.RepeatedQueryMiddleware')
+
 ROOT_URLCONF = 'stock_exchange.urls'
 
 TEMPLATES = [
@@ -100,8 +106,22 @@ SWAGGER_SETTINGS = {
             'in': 'header',
         }
     },
+    # The UI pages load the prebuilt schema instead of regenerating it.
+    'SPEC_URL': 'schema-json',
+    # Imported by drf_yasg when a schema is generated, not at startup.
+    'DEFAULT_AUTO_SCHEMA_CLASS': 'stock_exchange_app.inspectors.IdempotencyKeyAutoSchema',
+}
+
+REDOC_SETTINGS = {
+    'SPEC_URL': 'schema-json',
 }
 
+# OpenAPI schema artifact written by `manage.py generate_schema` and served
+# as-is from /openapi.json. When it is missing the schema is generated on
+# demand and cached for OPENAPI_SCHEMA_CACHE_TIMEOUT seconds.
+OPENAPI_SCHEMA_FILE = BASE_DIR / 'static' / 'openapi.json'
+OPENAPI_SCHEMA_CACHE_TIMEOUT = 60 * 60
+
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
 
@@ -116,6 +136,58 @@ DATABASES = {
     }
 }
 
+# Set STOCK_EXCHANGE_SQLITE_SHARDS=<n> to run locally against n SQLite shard files.
+SQLITE_SHARDS = int(os.environ.get('STOCK_EXCHANGE_SQLITE_SHARDS', '0'))
+if SQLITE_SHARDS:
+    DATABASES = {
+        ('default' if index == 0 else f'shard_{index}'): {
+            "ENGINE": "django.db.backends.sqlite3",
+            "NAME": BASE_DIR / f'shard_{index}.sqlite3',
+            # Take the write lock up front and wait for parallel batch workers instead of failing.
+            "OPTIONS": {"timeout": 30, "transaction_mode": "IMMEDIATE"},
+        }
+        for index in range(SQLITE_SHARDS)
+    }
+
+# Users and their Transaction rows are spread over SHARD_DATABASES by a consistent
+# hash of the username; Stocks are replicated to every shard. See stock_exchange_app/sharding.py.
+SHARD_DATABASES = list(DATABASES)
+SHARD_VIRTUAL_NODES = 64
+# Node bits of the ids generated for sharded rows (0-1023). Leave unset to have each process
+# claim one from the primary database; set it only if every process gets its own value.
+SHARD_NODE_ID = int(os.environ['STOCK_EXCHANGE_NODE_ID']) if 'STOCK_EXCHANGE_NODE_ID' in os.environ else None
+
+DATABASE_ROUTERS = ['stock_exchange_app.sharding.ShardRouter']
+
+# A BalanceSnapshot is written after this many LedgerEntry rows per user.
+LEDGER_SNAPSHOT_INTERVAL = 100
+
+# Buffered price ticks are written to the database every PRICE_FLUSH_INTERVAL seconds.
+# Ticks for new tickers are dropped while PRICE_MAX_PENDING_TICKERS tickers are pending.
+PRICE_FLUSH_INTERVAL = 0.5
+PRICE_MAX_PENDING_TICKERS = 100000
+# Called with {ticker: price} after every flush; fires crossed conditional orders.
+PRICE_FLUSH_LISTENERS = ['stock_exchange_app.triggers.on_prices']
+
+# How often the trigger engine polls for conditional orders created by other processes.
+TRIGGER_REFRESH_INTERVAL = 1.0
+
+# Pre-trade risk limits (None = unlimited); per-user overrides are RiskLimit rows.
+# Exposures are net notional per ticker at trade prices, daily volume is in shares.
+RISK_DEFAULT_LIMITS = {
+    'max_order_notional': None,
+    'max_ticker_exposure': None,
+    'max_total_exposure': None,
+    'max_daily_volume': None,
+}
+# How often each process syncs its risk state with trades and limits written by other processes.
+RISK_SYNC_INTERVAL = 1.0
+
+# Responses to requests sent with an Idempotency-Key header are replayed to retries for this
+# many seconds; completed results are cached in IDEMPOTENCY_CACHE in front of the database.
+IDEMPOTENCY_KEY_TTL = 24 * 60 * 60
+IDEMPOTENCY_CACHE = 'default'
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
@@ -14,3 +14,9 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'stock_exchange.settings')
 
 application = get_wsgi_application()
+
+# Build the in-memory risk state and claim the id node now rather than during the first request.
+from stock_exchange_app import risk, sharding  # noqa: E402
+
+risk.warm_up()
+sharding.claim_node_id()
@@ -1,9 +1,28 @@
 from django.contrib import admin
-from .models import Users, Stocks, Transaction
+from .models import Users, Stocks, Transaction, LedgerEntry, BalanceSnapshot, ConditionalOrder, DailyStatement, RiskLimit, IdempotencyKey, IdNode
+from .querybudget import QueryBudgetAdminMixin
 
 
+# Session, user, the two changelist counts and the page itself; constant in the number of rows.
+CHANGELIST_QUERY_BUDGET = 5
 
-admin.site.register(Users)
-admin.site.register(Stocks)
-admin.site.register(Transaction)
 
+class BudgetedAdmin(QueryBudgetAdminMixin, admin.ModelAdmin):
+    changelist_query_budget = CHANGELIST_QUERY_BUDGET
+
+
+@admin.register(Transaction)
+class TransactionAdmin(BudgetedAdmin):
+    # Transaction.__str__ reads user.username and ticker.ticker.
+    list_select_related = ('user', 'ticker')
+
+
+admin.site.register(Users, BudgetedAdmin)
+admin.site.register(Stocks, BudgetedAdmin)
+admin.site.register(LedgerEntry, BudgetedAdmin)
+admin.site.register(BalanceSnapshot, BudgetedAdmin)
+admin.site.register(ConditionalOrder, BudgetedAdmin)
+admin.site.register(DailyStatement, BudgetedAdmin)
+admin.site.register(RiskLimit, BudgetedAdmin)
+admin.site.register(IdempotencyKey, BudgetedAdmin)
+admin.site.register(IdNode, BudgetedAdmin)
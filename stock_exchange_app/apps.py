@@ -4,3 +4,17 @@ from django.apps import AppConfig
 class StockExchangeAppConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'stock_exchange_app'
+
+    def ready(self):
+        from django.core.checks import register
+        from django.db.models.signals import post_delete, post_save
+        from stock_exchange.schema import check_prebuilt_schema
+        from .models import RiskLimit, Stocks
+        from .risk import limits_deleted, limits_saved
+        from .sharding import delete_replicas, replicate_instance
+
+        post_save.connect(replicate_instance, sender=Stocks, dispatch_uid='replicate_stocks')
+        post_delete.connect(delete_replicas, sender=Stocks, dispatch_uid='delete_stock_replicas')
+        post_save.connect(limits_saved, sender=RiskLimit, dispatch_uid='risk_limits_saved')
+        post_delete.connect(limits_deleted, sender=RiskLimit, dispatch_uid='risk_limits_deleted')
+        register(check_prebuilt_schema, deploy=True)
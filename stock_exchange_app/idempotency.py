@@ -0,0 +1,156 @@
+"""
+Idempotency-Key support for retried POST requests.
+
+The first request with a given key claims it by inserting an IdempotencyKey row
+on the primary database and runs the view inside that same transaction, then
+stores the response on the row. Until the transaction ends, a concurrent
+duplicate blocks on the row's unique index, so it waits for the in-flight
+request instead of executing twice, and then replays the stored response.
+
+The claim on the primary cannot commit together with writes on a user's shard,
+so views also get `request.idempotency_key` to store with their own write (see
+trading.execute_trade): a retry whose claim was lost finds that write instead of
+repeating it. Views set `request.idempotent_write = True` once they have written;
+a server error after that keeps the claim, without a response, and the next
+retry runs the view again to recover the result.
+
+Completed results are also cached (IDEMPOTENCY_CACHE) for IDEMPOTENCY_KEY_TTL
+seconds, so most replays are answered without a query. Server errors (5xx)
+before any write are not stored, which lets the client retry them with the same key.
+"""
+import hashlib
+import json
+from datetime import timedelta
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+
+from .models import IdempotencyKey
+from .sharding import PRIMARY_DATABASE
+
+HEADER = 'Idempotency-Key'
+REPLAYED_HEADER = 'Idempotent-Replayed'
+MAX_KEY_LENGTH = 255
+
+
+def request_fingerprint(request):
+    """
+    Hash of the method, path and parsed body, used to detect a key reused for a different request.
+    """
+    data = request.data
+    if hasattr(data, 'lists'):
+        data = dict(data.lists())
+    payload = json.dumps([request.method, request.path, data], sort_keys=True, cls=DjangoJSONEncoder)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def _key_digest(scope, key):
+    return hashlib.sha256(f"{scope}:{key}".encode()).hexdigest()
+
+
+def _replay(stored, fingerprint):
+    if stored['fingerprint'] != fingerprint:
+        return Response({'error': f"{HEADER} was already used for a different request."},
+                        status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+    response = Response(stored['body'], status=stored['status'])
+    response[REPLAYED_HEADER] = 'true'
+    return response
+
+
+def _remember(cache_key, record):
+    stored = {
+        'fingerprint': record.fingerprint,
+        'status': record.response_status,
+        'body': record.response_body,
+    }
+    timeout = (record.expires_at - timezone.now()).total_seconds()
+    if timeout > 0 and record.response_status is not None:
+        caches[settings.IDEMPOTENCY_CACHE].set(cache_key, stored, timeout)
+    return stored
+
+
+def _run(view_func, record, cache_key, request, args, kwargs):
+    """
+    Run the view while holding the claim on `record` and store its response.
+    Must be called inside a transaction on the primary database.
+    """
+    response = view_func(request, *args, **kwargs)
+    if response.status_code >= 500:
+        if not getattr(request, 'idempotent_write', False):
+            # Nothing was written: release the key (and, unsharded, roll back the view's writes).
+            transaction.set_rollback(True, using=PRIMARY_DATABASE)
+        return response
+    record.response_status = response.status_code
+    record.response_body = response.data
+    record.save(update_fields=['response_status', 'response_body'])
+    transaction.on_commit(lambda: _remember(cache_key, record), using=PRIMARY_DATABASE)
+    return response
+
+
+def idempotent(view_func):
+    """
+    Decorator for views that must execute at most once per Idempotency-Key header.
+    Keys are scoped to the authenticated user, so apply it inside JWT_Required.
+    Requests without the header run normally. The header is documented in the
+    OpenAPI schema by inspectors.IdempotencyKeyAutoSchema.
+    """
+    @wraps(view_func)
+    def wrapper(request, *args, **kwargs):
+        key = request.headers.get(HEADER)
+        if key is None:
+            return view_func(request, *args, **kwargs)
+        if not key or len(key) > MAX_KEY_LENGTH:
+            return Response({'error': f"{HEADER} must be 1 to {MAX_KEY_LENGTH} characters."},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        scope = str(getattr(request.user, 'pk', None) or '')
+        fingerprint = request_fingerprint(request)
+        request.idempotency_key = _key_digest(scope, key)
+        cache_key = 'idempotency:' + request.idempotency_key
+
+        stored = caches[settings.IDEMPOTENCY_CACHE].get(cache_key)
+        if stored is not None:
+            return _replay(stored, fingerprint)
+
+        keys = IdempotencyKey.objects.using(PRIMARY_DATABASE)
+        # Two rounds: the second runs after an expired or rolled back claim.
+        for _ in range(2):
+            now = timezone.now()
+            record = None
+            try:
+                with transaction.atomic(using=PRIMARY_DATABASE):
+                    record = keys.create(
+                        scope=scope,
+                        key=key,
+                        fingerprint=fingerprint,
+                        expires_at=now + timedelta(seconds=settings.IDEMPOTENCY_KEY_TTL),
+                    )
+                    return _run(view_func, record, cache_key, request, args, kwargs)
+            except IntegrityError:
+                if record is not None:
+                    raise
+                # The key is taken; the insert waited for an in-flight request holding it to finish.
+
+            with transaction.atomic(using=PRIMARY_DATABASE):
+                record = keys.select_for_update().filter(scope=scope, key=key).first()
+                if record is None:
+                    continue
+                if record.expires_at <= now:
+                    record.delete()
+                    continue
+                if record.fingerprint == fingerprint and record.response_status is None:
+                    # An earlier attempt wrote but failed before responding; the view finds its write.
+                    return _run(view_func, record, cache_key, request, args, kwargs)
+            return _replay(_remember(cache_key, record), fingerprint)
+
+        return Response({'error': f"A request with this {HEADER} is still in progress."},
+                        status=status.HTTP_409_CONFLICT)
+
+    wrapper.idempotency_header = HEADER
+    return wrapper
@@ -0,0 +1,25 @@
+"""
+drf_yasg inspectors for the Stock Exchange API.
+
+Loaded by drf_yasg through SWAGGER_SETTINGS['DEFAULT_AUTO_SCHEMA_CLASS'] only when
+a schema is generated, so the views do not import drf_yasg.openapi at startup.
+"""
+from drf_yasg import openapi
+from drf_yasg.inspectors import SwaggerAutoSchema
+
+
+class IdempotencyKeyAutoSchema(SwaggerAutoSchema):
+    """
+    Documents the Idempotency-Key header on view methods wrapped with idempotency.idempotent.
+    """
+
+    def add_manual_parameters(self, parameters):
+        parameters = super().add_manual_parameters(parameters)
+        view_method = getattr(self.view, self.method.lower(), None)
+        header = getattr(view_method, 'idempotency_header', None)
+        if header and not any(param.name == header for param in parameters):
+            parameters.append(openapi.Parameter(
+                header, openapi.IN_HEADER, type=openapi.TYPE_STRING, required=False,
+                description="Unique per trade; retries with the same key replay the first result.",
+            ))
+        return parameters
@@ -0,0 +1,88 @@
+"""
+Balance ledger: append-only LedgerEntry rows with periodic BalanceSnapshot rows.
+
+A user's balance at any time is the latest snapshot taken before that time plus
+the entries recorded after it, so lookups never scan the full history. A new
+snapshot is written once LEDGER_SNAPSHOT_INTERVAL entries have accumulated
+since the previous one.
+"""
+from django.conf import settings
+from django.db.models import Case, Count, F, FloatField, Q, Sum, When
+
+from .models import BalanceSnapshot, LedgerEntry
+
+
+def signed_amount(prefix=''):
+    """
+    Expression for an entry's effect on the balance: credits are positive, debits negative.
+    """
+    return Case(
+        When(**{prefix + 'entry_type': LedgerEntry.DEBIT}, then=-F(prefix + 'amount')),
+        default=F(prefix + 'amount'),
+        output_field=FloatField(),
+    )
+
+
+def _latest_snapshot(user, at=None):
+    snapshots = BalanceSnapshot.objects.filter(user=user)
+    if at is not None:
+        snapshots = snapshots.filter(as_of__lte=at)
+    return snapshots.order_by('-as_of', '-last_entry_id').first()
+
+
+def _entries_after(user, snapshot):
+    entries = LedgerEntry.objects.filter(user=user)
+    if snapshot is not None:
+        entries = entries.filter(
+            Q(created_time__gt=snapshot.as_of)
+            | Q(created_time=snapshot.as_of, pk__gt=snapshot.last_entry_id)
+        )
+    return entries
+
+
+def balance_at(user, at=None):
+    """
+    Return the user's ledger balance as of `at` (default: now).
+    """
+    snapshot = _latest_snapshot(user, at)
+    entries = _entries_after(user, snapshot)
+    if at is not None:
+        entries = entries.filter(created_time__lte=at)
+
+    tail = entries.aggregate(total=Sum(signed_amount()))['total'] or 0.0
+    return (snapshot.balance if snapshot else 0.0) + tail
+
+
+def record_entry(user, entry_type, amount, reason, transaction=None):
+    """
+    Append an entry to the user's ledger and snapshot the balance when the interval is reached.
+    Call inside the same database transaction that updates Users.balance.
+    """
+    entry = LedgerEntry.objects.create(
+        user=user,
+        entry_type=entry_type,
+        amount=amount,
+        reason=reason,
+        transaction=transaction,
+    )
+
+    snapshot = _latest_snapshot(user)
+    tail = _entries_after(user, snapshot).aggregate(count=Count('pk'), total=Sum(signed_amount()))
+    if tail['count'] >= settings.LEDGER_SNAPSHOT_INTERVAL:
+        last_entry = _entries_after(user, snapshot).order_by('-created_time', '-pk').first()
+        BalanceSnapshot.objects.create(
+            user=user,
+            balance=(snapshot.balance if snapshot else 0.0) + tail['total'],
+            as_of=last_entry.created_time,
+            last_entry_id=last_entry.pk,
+        )
+    return entry
+
+
+def credit(user, amount, reason, transaction=None):
+    return record_entry(user, LedgerEntry.CREDIT, amount, reason, transaction)
+
+
+def debit(user, amount, reason, transaction=None):
+    return record_entry(user, LedgerEntry.DEBIT, amount, reason, transaction)
+
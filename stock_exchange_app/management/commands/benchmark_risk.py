@@ -0,0 +1,74 @@
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from stock_exchange_app.risk import RiskEngine, RiskLimits
+
+
+class Command(BaseCommand):
+    """
+    Benchmarks the in-memory pre-trade risk check as the trade path runs it: reserve, then release. Runs entirely in memory; no database access.
+    """
+
+    help = "Measure the per-trade overhead of the risk engine's reserve and release."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100000, help="Users with open positions.")
+        parser.add_argument('--tickers', type=int, default=1000, help="Distinct tickers.")
+        parser.add_argument('--history', type=int, default=1000000, help="Trades applied before measuring.")
+        parser.add_argument('--checks', type=int, default=200000, help="Reservations to time.")
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        engine = RiskEngine(default=RiskLimits(
+            max_order_notional=25000.0,
+            max_ticker_exposure=20000.0,
+            max_total_exposure=150000.0,
+            max_daily_volume=600.0,
+        ))
+        now = timezone.now()
+
+        def random_trade():
+            return (
+                rng.randrange(options['users']),
+                rng.randrange(options['tickers']),
+                rng.choice(('BUY', 'SELL')),
+                float(rng.randint(1, 100)),
+                rng.uniform(10, 500),
+            )
+
+        start = time.perf_counter()
+        for pk in range(options['history']):
+            user_id, ticker_id, transaction_type, volume, price = random_trade()
+            engine.apply_trade(pk, user_id, ticker_id, transaction_type, volume, volume * price, now)
+        load_seconds = time.perf_counter() - start
+
+        trades = [random_trade() for _ in range(options['checks'])]
+        rejected = 0
+        latencies = []
+        # The trade path reserves before writing and releases (or records) once the trade ends.
+        for user_id, ticker_id, transaction_type, volume, price in trades:
+            started = time.perf_counter()
+            reason, token = engine.reserve(user_id, ticker_id, transaction_type, volume, volume * price)
+            engine.release(token)
+            latencies.append(time.perf_counter() - started)
+            rejected += reason is not None
+
+        start = time.perf_counter()
+        for user_id, ticker_id, transaction_type, volume, price in trades:
+            _, token = engine.reserve(user_id, ticker_id, transaction_type, volume, volume * price)
+            engine.release(token)
+        batch_seconds = time.perf_counter() - start
+
+        latencies.sort()
+        self.stdout.write(f"Applied {options['history']} trades for {options['users']} users "
+                          f"in {load_seconds:.2f} s")
+        self.stdout.write(f"Checked {len(trades)} trades, {rejected} rejected")
+        self.stdout.write(f"Reserve + release per trade: mean {statistics.mean(latencies) * 1e6:.2f} us, "
+                          f"p99 {latencies[int(len(latencies) * 0.99) - 1] * 1e6:.2f} us, "
+                          f"max {latencies[-1] * 1e6:.1f} us")
+        self.stdout.write(f"Back-to-back reserve + release: {batch_seconds / len(trades) * 1e6:.2f} us per trade")
@@ -0,0 +1,81 @@
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+
+from stock_exchange_app.models import ConditionalOrder
+from stock_exchange_app.triggers import TriggerIndex
+
+
+class Command(BaseCommand):
+    """
+    Benchmarks the in-memory trigger index against a linear scan of resting orders.
+    Runs entirely in memory; no database access.
+    """
+
+    help = "Measure trigger firing cost with many resting conditional orders."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--orders', type=int, default=1000000, help="Resting orders to index.")
+        parser.add_argument('--tickers', type=int, default=1000, help="Distinct tickers.")
+        parser.add_argument('--updates', type=int, default=100000, help="Price updates to replay.")
+        parser.add_argument('--scan-updates', type=int, default=20,
+                            help="Price updates to replay with a linear scan, for comparison.")
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        tickers = [f"T{index:05d}" for index in range(options['tickers'])]
+        prices = {ticker: 100.0 for ticker in tickers}
+
+        orders = [
+            (
+                order_id,
+                rng.choice(tickers),
+                rng.choice((ConditionalOrder.ABOVE, ConditionalOrder.BELOW)),
+                100.0 * rng.uniform(0.5, 1.5),
+            )
+            for order_id in range(options['orders'])
+        ]
+
+        start = time.perf_counter()
+        index = TriggerIndex()
+        for order_id, ticker, direction, trigger_price in orders:
+            index.add(order_id, ticker, direction, trigger_price)
+        build_seconds = time.perf_counter() - start
+
+        updates = []
+        for _ in range(options['updates']):
+            ticker = rng.choice(tickers)
+            prices[ticker] *= 1 + rng.gauss(0, 0.01)
+            updates.append((ticker, prices[ticker]))
+
+        fired = 0
+        latencies = []
+        for ticker, price in updates:
+            started = time.perf_counter()
+            fired += len(index.crossed(ticker, price))
+            latencies.append(time.perf_counter() - started)
+
+        scan_latencies = []
+        for ticker, price in updates[:options['scan_updates']]:
+            started = time.perf_counter()
+            [
+                order for order in orders
+                if order[1] == ticker and (
+                    order[3] <= price if order[2] == ConditionalOrder.ABOVE else order[3] >= price
+                )
+            ]
+            scan_latencies.append(time.perf_counter() - started)
+
+        latencies.sort()
+        self.stdout.write(f"Indexed {options['orders']} orders on {options['tickers']} tickers "
+                          f"in {build_seconds:.2f} s")
+        self.stdout.write(f"Replayed {len(updates)} price updates, fired {fired} orders, "
+                          f"{len(index)} still resting")
+        self.stdout.write(f"Index per update: mean {statistics.mean(latencies) * 1e6:.1f} us, "
+                          f"p99 {latencies[int(len(latencies) * 0.99) - 1] * 1e6:.1f} us, "
+                          f"max {latencies[-1] * 1e6:.1f} us")
+        if scan_latencies:
+            self.stdout.write(f"Linear scan per update: mean {statistics.mean(scan_latencies) * 1e6:.1f} us")
@@ -0,0 +1,94 @@
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import date, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.utils import timezone
+
+from stock_exchange_app.models import EndOfDayCheckpoint
+from stock_exchange_app.sharding import PRIMARY_DATABASE, shard_databases, user_id_ranges
+from stock_exchange_app.statements import build_statements
+
+
+def _init_worker():
+    import django
+    from django.apps import apps
+
+    # Spawned (non-forked) workers start without Django configured.
+    if not apps.ready:
+        django.setup()
+
+
+class Command(BaseCommand):
+    """
+    Builds DailyStatement rows for every user, splitting users into ranges processed on a process pool.
+
+    Each finished range is checkpointed, so re-running the command for the same
+    date after a crash only processes the ranges that did not complete.
+    """
+
+    help = "Generate end-of-day statements (per-ticker totals and closing balance) for every user."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--date', type=date.fromisoformat,
+                            help="Statement date as YYYY-MM-DD (default: yesterday).")
+        parser.add_argument('--range-size', type=int, default=1000, help="Users per worker task.")
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help="Worker processes.")
+        parser.add_argument('--restart', action='store_true',
+                            help="Ignore existing checkpoints for the date and rebuild every range.")
+
+    def handle(self, *args, **options):
+        statement_date = options['date'] or timezone.localdate() - timedelta(days=1)
+        if options['range_size'] < 1 or options['workers'] < 1:
+            raise CommandError("--range-size and --workers must be positive.")
+
+        checkpoints = EndOfDayCheckpoint.objects.using(PRIMARY_DATABASE).filter(statement_date=statement_date)
+        if options['restart']:
+            checkpoints.delete()
+        # A range only counts as done with the same bounds: the last range grows as users are
+        # added after a run, and build_statements redoes a range whose bounds changed.
+        done = set(checkpoints.values_list('database', 'first_user_id', 'last_user_id'))
+
+        ranges = [
+            (alias, first_user_id, last_user_id)
+            for alias in shard_databases()
+            for first_user_id, last_user_id in user_id_ranges(alias, options['range_size'])
+            if (alias, first_user_id, last_user_id) not in done
+        ]
+        self.stdout.write(f"{statement_date}: {len(ranges)} user ranges to process, {len(done)} already done.")
+        if not ranges:
+            return
+
+        # Workers are forked where possible; they must not reuse the parent's connections.
+        connections.close_all()
+        methods = multiprocessing.get_all_start_methods()
+        context = multiprocessing.get_context('fork' if 'fork' in methods else None)
+
+        rows = 0
+        start = time.perf_counter()
+        with ProcessPoolExecutor(max_workers=options['workers'], mp_context=context,
+                                 initializer=_init_worker) as executor:
+            futures = {
+                executor.submit(build_statements, alias, statement_date, first_user_id, last_user_id):
+                    (alias, first_user_id, last_user_id)
+                for alias, first_user_id, last_user_id in ranges
+            }
+            for completed, future in enumerate(as_completed(futures), start=1):
+                alias, first_user_id, last_user_id = futures[future]
+                try:
+                    rows += future.result()
+                except Exception as e:
+                    raise CommandError(
+                        f"Range {alias} [{first_user_id}, {last_user_id}] failed: {e}. "
+                        f"Re-run the command to resume from the last checkpoint."
+                    ) from e
+                elapsed = time.perf_counter() - start
+                self.stdout.write(f"[{completed}/{len(ranges)}] {rows} rows, {rows / elapsed:.0f} rows/sec")
+
+        elapsed = time.perf_counter() - start
+        self.stdout.write(self.style.SUCCESS(
+            f"Wrote {rows} statement rows in {elapsed:.1f} s ({rows / elapsed:.0f} rows/sec)."
+        ))
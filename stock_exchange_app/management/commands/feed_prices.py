@@ -0,0 +1,74 @@
+import signal
+import socketserver
+import sys
+
+from django.core.management.base import BaseCommand
+
+from stock_exchange_app.pricefeed import PriceTickBuffer
+
+
+def parse_tick(line):
+    """
+    Parse a 'TICKER PRICE' or 'TICKER,PRICE' line into (ticker, price); invalid lines give (None, None).
+    """
+    parts = line.replace(',', ' ').split()
+    if len(parts) != 2:
+        return None, None
+    try:
+        return parts[0], float(parts[1])
+    except ValueError:
+        return None, None
+
+
+def _interrupt(signum, frame):
+    raise KeyboardInterrupt
+
+
+class Command(BaseCommand):
+    """
+    Feeds price ticks from stdin or a TCP socket into the coalescing price buffer.
+    """
+
+    help = "Read 'TICKER PRICE' lines from stdin (or --port) and flush the latest prices in bulk."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--port', type=int, help="Listen for newline-delimited ticks on this TCP port instead of stdin.")
+        parser.add_argument('--host', default='127.0.0.1', help="Address to listen on with --port.")
+        parser.add_argument('--interval', type=float, help="Flush interval in seconds (default: PRICE_FLUSH_INTERVAL).")
+
+    def handle(self, *args, **options):
+        price_buffer = PriceTickBuffer(interval=options['interval'])
+        price_buffer.start()
+        # Flush pending prices on SIGTERM as well as Ctrl-C.
+        signal.signal(signal.SIGTERM, _interrupt)
+        try:
+            if options['port']:
+                self.serve(price_buffer, options['host'], options['port'])
+            else:
+                for line in sys.stdin:
+                    price_buffer.submit(*parse_tick(line))
+        except KeyboardInterrupt:
+            pass
+        finally:
+            price_buffer.stop()
+
+        metrics = price_buffer.metrics()
+        self.stdout.write(self.style.SUCCESS(
+            "Received {received} ticks: {merged} merged, {dropped} dropped, "
+            "{flushed_tickers} prices written in {flushes} flushes "
+            "(max flush lag {lag:.1f} ms).".format(lag=metrics['max_flush_lag_ms'] or 0.0, **metrics)
+        ))
+
+    def serve(self, price_buffer, host, port):
+        class TickHandler(socketserver.StreamRequestHandler):
+            def handle(self):
+                for line in self.rfile:
+                    price_buffer.submit(*parse_tick(line.decode('utf-8', 'replace')))
+
+        class TickServer(socketserver.ThreadingTCPServer):
+            daemon_threads = True
+            allow_reuse_address = True
+
+        with TickServer((host, port), TickHandler) as server:
+            self.stdout.write(f"Listening for price ticks on {host}:{port}")
+            server.serve_forever()
@@ -0,0 +1,49 @@
+import os
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    """
+    Generates the OpenAPI schema at build time into the static file served by /openapi.json.
+    """
+
+    help = "Generate the OpenAPI schema into OPENAPI_SCHEMA_FILE (or --output)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', help="Path to write the schema to. Defaults to settings.OPENAPI_SCHEMA_FILE.")
+        parser.add_argument('--check', action='store_true',
+                            help="Exit with an error if the schema file is missing or out of date, without writing it.")
+
+    def handle(self, *args, **options):
+        from stock_exchange.schema import generate_schema
+
+        output = str(options['output'] or settings.OPENAPI_SCHEMA_FILE)
+
+        start = time.perf_counter()
+        content = generate_schema()
+        elapsed = (time.perf_counter() - start) * 1000
+
+        if options['check']:
+            try:
+                with open(output, 'rb') as schema_file:
+                    current = schema_file.read()
+            except FileNotFoundError:
+                raise CommandError(f"{output} does not exist; run `manage.py generate_schema`.")
+            if current != content:
+                raise CommandError(f"{output} is out of date; run `manage.py generate_schema`.")
+            self.stdout.write(f"{output} is up to date.")
+            return
+
+        # Write to a temporary file first so running servers never read a partial schema.
+        os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+        tmp_output = output + '.tmp'
+        with open(tmp_output, 'wb') as schema_file:
+            schema_file.write(content)
+        os.replace(tmp_output, output)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Wrote OpenAPI schema to {output} ({len(content)} bytes, generated in {elapsed:.1f} ms)"
+        ))
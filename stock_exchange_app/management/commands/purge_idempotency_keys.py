@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from stock_exchange_app.models import IdempotencyKey
+from stock_exchange_app.sharding import PRIMARY_DATABASE
+
+
+class Command(BaseCommand):
+    """
+    Deletes expired IdempotencyKey rows in batches. Expired keys are already ignored
+    when a request reuses them; this only keeps the table small.
+    """
+
+    help = "Delete stored Idempotency-Key results older than IDEMPOTENCY_KEY_TTL."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=10000, help="Rows deleted per query.")
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError("--batch-size must be positive.")
+
+        keys = IdempotencyKey.objects.using(PRIMARY_DATABASE)
+        now = timezone.now()
+        deleted = 0
+        while True:
+            batch = list(keys.filter(expires_at__lte=now).values_list('pk', flat=True)[:options['batch_size']])
+            if not batch:
+                break
+            deleted += keys.filter(pk__in=batch).delete()[0]
+
+        self.stdout.write(self.style.SUCCESS(f"Deleted {deleted} expired idempotency keys."))
@@ -0,0 +1,118 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from stock_exchange_app.models import Users
+from stock_exchange_app.sharding import (
+    PRIMARY_DATABASE,
+    is_sharded,
+    replicated_models,
+    shard_databases,
+    shard_for_username,
+    user_owned_models,
+)
+
+
+class Command(BaseCommand):
+    """
+    Moves users (and all rows they own) to the shard their username hashes to.
+
+    Run after adding or removing an alias in SHARD_DATABASES. Users are moved in
+    small batches, each in its own transaction, so the API keeps serving while
+    the command runs; lookups that miss the new shard fall back to the others.
+    """
+
+    help = "Copy reference data to every shard and move users to the shard that owns them."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help="Users moved per transaction.")
+        parser.add_argument('--pause', type=float, default=0.0, help="Seconds to sleep between batches.")
+        parser.add_argument('--dry-run', action='store_true', help="Only report how many users would move.")
+
+    def handle(self, *args, **options):
+        if not is_sharded():
+            raise CommandError("SHARD_DATABASES has a single database; nothing to rebalance.")
+
+        batch_size = options['batch_size']
+        if batch_size < 1:
+            raise CommandError("--batch-size must be positive.")
+
+        if not options['dry_run']:
+            self.sync_replicated_models()
+
+        moved = 0
+        for source in shard_databases():
+            moved += self.rebalance_shard(source, batch_size, options['pause'], options['dry_run'])
+
+        verb = "would move" if options['dry_run'] else "moved"
+        self.stdout.write(self.style.SUCCESS(f"Rebalance complete: {verb} {moved} users."))
+
+    def sync_replicated_models(self):
+        """
+        Make every shard's copy of replicated models match the primary.
+        """
+        for model in replicated_models():
+            rows = list(model._default_manager.using(PRIMARY_DATABASE).all())
+            fields = [field.name for field in model._meta.concrete_fields if not field.primary_key]
+            for alias in shard_databases():
+                if alias == PRIMARY_DATABASE:
+                    continue
+                existing = set(model._default_manager.using(alias).values_list('pk', flat=True))
+                with transaction.atomic(using=alias):
+                    model._default_manager.using(alias).exclude(pk__in=[row.pk for row in rows]).delete()
+                    model._default_manager.using(alias).bulk_update(
+                        [row for row in rows if row.pk in existing], fields, batch_size=1000
+                    )
+                    model._default_manager.using(alias).bulk_create(
+                        [row for row in rows if row.pk not in existing], batch_size=1000
+                    )
+                self.stdout.write(f"Synced {len(rows)} {model.__name__} rows to {alias}.")
+
+    def rebalance_shard(self, source, batch_size, pause, dry_run):
+        moved = 0
+        last_pk = None
+        while True:
+            batch = Users.objects.using(source).order_by('pk')
+            if last_pk is not None:
+                batch = batch.filter(pk__gt=last_pk)
+            batch = list(batch.values_list('pk', 'username')[:batch_size])
+            if not batch:
+                break
+            last_pk = batch[-1][0]
+
+            by_target = {}
+            for pk, username in batch:
+                target = shard_for_username(username)
+                if target != source:
+                    by_target.setdefault(target, []).append(pk)
+
+            for target, user_ids in by_target.items():
+                if not dry_run:
+                    self.move_users(user_ids, source, target)
+                moved += len(user_ids)
+                self.stdout.write(f"{source} -> {target}: {len(user_ids)} users")
+
+            if pause and by_target:
+                time.sleep(pause)
+        return moved
+
+    def move_users(self, user_ids, source, target):
+        """
+        Copy users and their rows to the target shard, then delete them from the source.
+        """
+        with transaction.atomic(using=source), transaction.atomic(using=target):
+            # Lock the source rows so concurrent writes for these users wait for the move.
+            users = list(Users.objects.using(source).select_for_update().filter(pk__in=user_ids))
+            owned = [
+                (model, list(model._default_manager.using(source).filter(user_id__in=user_ids)))
+                for model in user_owned_models()
+            ]
+
+            # Clear leftovers of an earlier interrupted move so the copy is idempotent.
+            Users.objects.using(target).filter(pk__in=user_ids).delete()
+            Users.objects.using(target).bulk_create(users, batch_size=1000)
+            for model, rows in owned:
+                model._default_manager.using(target).bulk_create(rows, batch_size=1000)
+
+            Users.objects.using(source).filter(pk__in=user_ids).delete()
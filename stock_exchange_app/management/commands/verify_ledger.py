@@ -0,0 +1,79 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.db.models import FloatField, Sum, Value
+from django.db.models.functions import Coalesce
+
+from stock_exchange_app.ledger import signed_amount
+from stock_exchange_app.models import Users
+from stock_exchange_app.sharding import shard_databases, user_id_ranges
+
+
+def verify_chunk(alias, first_pk, last_pk, tolerance):
+    """
+    Compare Users.balance with the ledger sum for one range of users, in a single aggregate query.
+    Returns (users checked, list of mismatches).
+    """
+    try:
+        rows = (
+            Users.objects.using(alias)
+            .filter(pk__gte=first_pk, pk__lte=last_pk)
+            .annotate(ledger_balance=Coalesce(
+                Sum(signed_amount('ledger_entries__')), Value(0.0), output_field=FloatField()
+            ))
+            .values_list('username', 'balance', 'ledger_balance')
+        )
+        checked = 0
+        mismatches = []
+        for username, balance, ledger_balance in rows:
+            checked += 1
+            if abs(balance - ledger_balance) > tolerance:
+                mismatches.append((alias, username, balance, ledger_balance))
+        return checked, mismatches
+    finally:
+        connections.close_all()
+
+
+class Command(BaseCommand):
+    """
+    Verifies that every materialized Users.balance matches the sum of the user's ledger entries.
+    """
+
+    help = "Check Users.balance against the ledger, in parallel chunks of users."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000, help="Users checked per query.")
+        parser.add_argument('--workers', type=int, default=4, help="Chunks checked in parallel.")
+        parser.add_argument('--tolerance', type=float, default=0.005,
+                            help="Largest allowed absolute difference between the two balances.")
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        if chunk_size < 1 or options['workers'] < 1:
+            raise CommandError("--chunk-size and --workers must be positive.")
+
+        chunks = [
+            (alias, first_pk, last_pk)
+            for alias in shard_databases()
+            for first_pk, last_pk in user_id_ranges(alias, chunk_size)
+        ]
+
+        checked = 0
+        mismatches = []
+        with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+            futures = [
+                executor.submit(verify_chunk, alias, first_pk, last_pk, options['tolerance'])
+                for alias, first_pk, last_pk in chunks
+            ]
+            for future in futures:
+                chunk_checked, chunk_mismatches = future.result()
+                checked += chunk_checked
+                mismatches.extend(chunk_mismatches)
+
+        for alias, username, balance, ledger_balance in mismatches:
+            self.stderr.write(f"{alias}: {username} balance={balance} ledger={ledger_balance}")
+
+        if mismatches:
+            raise CommandError(f"{len(mismatches)} of {checked} users do not match the ledger.")
+        self.stdout.write(self.style.SUCCESS(f"All {checked} user balances match the ledger."))
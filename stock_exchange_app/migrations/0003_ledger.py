@@ -0,0 +1,70 @@
+# Generated by Django 5.1.1 on 2026-10-19 00:47
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+from stock_exchange_app.sharding import is_sharded, next_id
+
+
+def record_opening_balances(apps, schema_editor):
+    """
+    Start every existing user's ledger with an entry for their current balance.
+    """
+    Users = apps.get_model('stock_exchange_app', 'Users')
+    LedgerEntry = apps.get_model('stock_exchange_app', 'LedgerEntry')
+    db_alias = schema_editor.connection.alias
+
+    # Historical models have no shard_by, so the router would send a `user=` relation to the
+    # primary; set the foreign key directly. Sharded rows need globally unique ids, as in
+    # ShardedModel.save, or rebalance_shards would hit clashing per-shard autoincrement ids.
+    entries = []
+    for pk, balance in Users.objects.using(db_alias).values_list('pk', 'balance').iterator():
+        entry = LedgerEntry(
+            user_id=pk,
+            entry_type='CREDIT' if balance >= 0 else 'DEBIT',
+            reason='OPENING',
+            amount=abs(balance),
+        )
+        if is_sharded():
+            entry.pk = next_id()
+        entries.append(entry)
+    LedgerEntry.objects.using(db_alias).bulk_create(entries, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stock_exchange_app', '0002_rename_user_users'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BalanceSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('balance', models.FloatField()),
+                ('as_of', models.DateTimeField()),
+                ('last_entry_id', models.BigIntegerField()),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='balance_snapshots', to='stock_exchange_app.users')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', 'as_of'], name='stock_excha_user_id_bdbd74_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='LedgerEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('entry_type', models.CharField(choices=[('CREDIT', 'Credit'), ('DEBIT', 'Debit')], max_length=6)),
+                ('reason', models.CharField(choices=[('OPENING', 'Opening balance'), ('FUNDING', 'Funding'), ('BUY', 'Buy'), ('SELL', 'Sell')], max_length=7)),
+                ('amount', models.FloatField()),
+                ('created_time', models.DateTimeField(auto_now_add=True)),
+                ('transaction', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.RESTRICT, to='stock_exchange_app.transaction')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ledger_entries', to='stock_exchange_app.users')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', 'created_time'], name='stock_excha_user_id_707f72_idx')],
+            },
+        ),
+        migrations.RunPython(record_opening_balances, migrations.RunPython.noop),
+    ]
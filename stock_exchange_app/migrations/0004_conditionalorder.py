@@ -0,0 +1,35 @@
+# Generated by Django 5.1.1 on 2026-10-19 00:51
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stock_exchange_app', '0003_ledger'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ConditionalOrder',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('order_type', models.CharField(choices=[('STOP_LOSS', 'Stop loss'), ('TAKE_PROFIT', 'Take profit')], max_length=11)),
+                ('transaction_type', models.CharField(choices=[('BUY', 'Buy'), ('SELL', 'Sell')], default='SELL', max_length=4)),
+                ('transaction_volume', models.FloatField()),
+                ('trigger_price', models.FloatField()),
+                ('direction', models.CharField(choices=[('ABOVE', 'Price at or above trigger'), ('BELOW', 'Price at or below trigger')], editable=False, max_length=5)),
+                ('status', models.CharField(choices=[('PENDING', 'Pending'), ('FILLED', 'Filled'), ('REJECTED', 'Rejected'), ('CANCELLED', 'Cancelled')], default='PENDING', max_length=9)),
+                ('status_reason', models.CharField(blank=True, max_length=100)),
+                ('created_time', models.DateTimeField(auto_now_add=True)),
+                ('triggered_time', models.DateTimeField(blank=True, null=True)),
+                ('ticker', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='stock_exchange_app.stocks')),
+                ('transaction', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='stock_exchange_app.transaction')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='stock_exchange_app.users')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['status', 'created_time'], name='stock_excha_status_589ddf_idx')],
+            },
+        ),
+    ]
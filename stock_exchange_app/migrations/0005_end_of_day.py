@@ -0,0 +1,46 @@
+# Generated by Django 5.1.1 on 2026-10-19 00:52
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stock_exchange_app', '0004_conditionalorder'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EndOfDayCheckpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('statement_date', models.DateField()),
+                ('database', models.CharField(max_length=100)),
+                ('first_user_id', models.BigIntegerField()),
+                ('last_user_id', models.BigIntegerField()),
+                ('rows', models.IntegerField()),
+                ('completed_time', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('statement_date', 'database', 'first_user_id'), name='unique_end_of_day_checkpoint')],
+            },
+        ),
+        migrations.CreateModel(
+            name='DailyStatement',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('statement_date', models.DateField()),
+                ('trade_count', models.IntegerField(default=0)),
+                ('volume', models.FloatField(default=0)),
+                ('notional', models.FloatField(default=0)),
+                ('closing_balance', models.FloatField()),
+                ('created_time', models.DateTimeField(auto_now_add=True)),
+                ('ticker', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='stock_exchange_app.stocks')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_statements', to='stock_exchange_app.users')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['statement_date', 'user'], name='stock_excha_stateme_5737e5_idx')],
+            },
+        ),
+    ]
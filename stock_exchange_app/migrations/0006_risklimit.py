@@ -0,0 +1,29 @@
+# Generated by Django 5.1.1 on 2026-10-19 01:00
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stock_exchange_app', '0005_end_of_day'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RiskLimit',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('max_order_notional', models.FloatField(blank=True, null=True)),
+                ('max_ticker_exposure', models.FloatField(blank=True, null=True)),
+                ('max_total_exposure', models.FloatField(blank=True, null=True)),
+                ('max_daily_volume', models.FloatField(blank=True, null=True)),
+                ('updated_time', models.DateTimeField(auto_now=True)),
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='risk_limit', to='stock_exchange_app.users')),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+    ]
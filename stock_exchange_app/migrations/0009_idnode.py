@@ -0,0 +1,22 @@
+# Generated by Django 5.1.1 on 2026-10-19 01:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stock_exchange_app', '0008_transaction_idempotency_key'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IdNode',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hostname', models.CharField(max_length=255)),
+                ('pid', models.IntegerField()),
+                ('claimed_time', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+    ]
@@ -1,10 +1,17 @@
+from django.core.serializers.json import DjangoJSONEncoder
 from django.db import models
 
-class Users(models.Model):
+from .sharding import ShardedModel
+
+
+class Users(ShardedModel):
     """
     A model representing a user with a username and balance.
+    Stored on the shard chosen by a hash of the username.
     """
 
+    shard_by = 'username'
+
     username = models.CharField(max_length=50, unique=True)
     balance = models.FloatField()
 
@@ -18,8 +25,11 @@ class Users(models.Model):
 class Stocks(models.Model):
     """
     A model representing a stock with ticker, price, and name.
+    Reference data replicated to every shard.
     """
 
+    replicated = True
+
     ticker = models.CharField(max_length=70, unique=True)
     stock_price = models.FloatField()
     stock_name = models.CharField(max_length=40)
@@ -31,11 +41,14 @@ class Stocks(models.Model):
         return self.ticker
 
 
-class Transaction(models.Model):
+class Transaction(ShardedModel):
     """
     A model representing a stock transaction.
+    Stored on the same shard as its user.
     """
 
+    shard_by = 'user'
+
     TRANSACTION_TYPE_CHOICES = [
         ('BUY', 'Buy'),
         ('SELL', 'Sell')
@@ -47,9 +60,268 @@ class Transaction(models.Model):
     transaction_volume = models.FloatField()
     transaction_price = models.FloatField()
     created_time = models.DateTimeField(auto_now_add=True)
+    # Digest of the request's Idempotency-Key, written with the trade so a retry cannot trade twice.
+    idempotency_key = models.CharField(max_length=64, null=True, blank=True, db_index=True, editable=False)
 
     def __str__(self):
         """
         Return a string representation showing the user, stock ticker, and transaction type.
         """
         return f"{self.user.username} - {self.ticker.ticker} - {self.transaction_type}"
+
+
+class LedgerEntry(ShardedModel):
+    """
+    An append-only credit or debit on a user's balance.
+    The sum of a user's entries is the authoritative balance; Users.balance is its materialized value.
+    Stored on the same shard as its user.
+    """
+
+    shard_by = 'user'
+
+    CREDIT = 'CREDIT'
+    DEBIT = 'DEBIT'
+    ENTRY_TYPE_CHOICES = [
+        (CREDIT, 'Credit'),
+        (DEBIT, 'Debit')
+    ]
+
+    OPENING = 'OPENING'
+    FUNDING = 'FUNDING'
+    REASON_CHOICES = [
+        (OPENING, 'Opening balance'),
+        (FUNDING, 'Funding'),
+        ('BUY', 'Buy'),
+        ('SELL', 'Sell')
+    ]
+
+    user = models.ForeignKey(Users, on_delete=models.CASCADE, related_name='ledger_entries')
+    entry_type = models.CharField(max_length=6, choices=ENTRY_TYPE_CHOICES)
+    reason = models.CharField(max_length=7, choices=REASON_CHOICES)
+    amount = models.FloatField()
+    transaction = models.ForeignKey(Transaction, on_delete=models.RESTRICT, null=True, blank=True)
+    created_time = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['user', 'created_time'])]
+
+    def save(self, *args, **kwargs):
+        """
+        Ledger entries can only be inserted, never updated.
+        """
+        if not self._state.adding:
+            raise ValueError("Ledger entries are append-only.")
+        super().save(*args, **kwargs)
+
+    def __str__(self):
+        """
+        Return a string representation showing the user, entry type, and amount.
+        """
+        return f"{self.user_id} - {self.entry_type} - {self.amount}"
+
+
+class BalanceSnapshot(ShardedModel):
+    """
+    A user's ledger balance as of a given entry, so balance lookups only sum the entries after it.
+    Stored on the same shard as its user.
+    """
+
+    shard_by = 'user'
+
+    user = models.ForeignKey(Users, on_delete=models.CASCADE, related_name='balance_snapshots')
+    balance = models.FloatField()
+    as_of = models.DateTimeField()
+    last_entry_id = models.BigIntegerField()
+
+    class Meta:
+        indexes = [models.Index(fields=['user', 'as_of'])]
+
+    def __str__(self):
+        """
+        Return a string representation showing the user, balance, and snapshot time.
+        """
+        return f"{self.user_id} - {self.balance} @ {self.as_of}"
+
+
+class ConditionalOrder(ShardedModel):
+    """
+    A stop-loss or take-profit order that executes when the stock price crosses trigger_price.
+    Stored on the same shard as its user.
+    """
+
+    shard_by = 'user'
+
+    ORDER_TYPE_CHOICES = [
+        ('STOP_LOSS', 'Stop loss'),
+        ('TAKE_PROFIT', 'Take profit')
+    ]
+
+    ABOVE = 'ABOVE'
+    BELOW = 'BELOW'
+    DIRECTION_CHOICES = [
+        (ABOVE, 'Price at or above trigger'),
+        (BELOW, 'Price at or below trigger')
+    ]
+
+    PENDING = 'PENDING'
+    FILLED = 'FILLED'
+    REJECTED = 'REJECTED'
+    CANCELLED = 'CANCELLED'
+    STATUS_CHOICES = [
+        (PENDING, 'Pending'),
+        (FILLED, 'Filled'),
+        (REJECTED, 'Rejected'),
+        (CANCELLED, 'Cancelled')
+    ]
+
+    user = models.ForeignKey(Users, on_delete=models.CASCADE)
+    ticker = models.ForeignKey(Stocks, on_delete=models.CASCADE)
+    order_type = models.CharField(max_length=11, choices=ORDER_TYPE_CHOICES)
+    transaction_type = models.CharField(max_length=4, choices=Transaction.TRANSACTION_TYPE_CHOICES, default='SELL')
+    transaction_volume = models.FloatField()
+    trigger_price = models.FloatField()
+    direction = models.CharField(max_length=5, choices=DIRECTION_CHOICES, editable=False)
+    status = models.CharField(max_length=9, choices=STATUS_CHOICES, default=PENDING)
+    status_reason = models.CharField(max_length=100, blank=True)
+    transaction = models.ForeignKey(Transaction, on_delete=models.SET_NULL, null=True, blank=True)
+    created_time = models.DateTimeField(auto_now_add=True)
+    triggered_time = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['status', 'created_time'])]
+
+    def save(self, *args, **kwargs):
+        """
+        Derive the trigger direction: a stop loss sells on a fall (or buys on a rise),
+        a take profit sells on a rise (or buys on a fall).
+        """
+        is_stop_loss = self.order_type == 'STOP_LOSS'
+        is_sell = self.transaction_type == 'SELL'
+        self.direction = self.BELOW if is_stop_loss == is_sell else self.ABOVE
+        super().save(*args, **kwargs)
+
+    def __str__(self):
+        """
+        Return a string representation showing the user, order type, and trigger price.
+        """
+        return f"{self.user_id} - {self.order_type} {self.transaction_type} @ {self.trigger_price}"
+
+
+class DailyStatement(ShardedModel):
+    """
+    A user's end-of-day trading totals for one ticker, with the closing balance for that day.
+    Users without trades get a single row with no ticker. Stored on the same shard as its user.
+    """
+
+    shard_by = 'user'
+
+    user = models.ForeignKey(Users, on_delete=models.CASCADE, related_name='daily_statements')
+    statement_date = models.DateField()
+    ticker = models.ForeignKey(Stocks, on_delete=models.CASCADE, null=True, blank=True)
+    trade_count = models.IntegerField(default=0)
+    volume = models.FloatField(default=0)
+    notional = models.FloatField(default=0)
+    closing_balance = models.FloatField()
+    created_time = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['statement_date', 'user'])]
+
+    def __str__(self):
+        """
+        Return a string representation showing the user, date, and ticker.
+        """
+        return f"{self.user_id} - {self.statement_date} - {self.ticker_id}"
+
+
+class EndOfDayCheckpoint(models.Model):
+    """
+    Marks a range of users on one database whose daily statements are complete,
+    so an interrupted end_of_day run resumes where it stopped.
+    """
+
+    statement_date = models.DateField()
+    database = models.CharField(max_length=100)
+    first_user_id = models.BigIntegerField()
+    last_user_id = models.BigIntegerField()
+    rows = models.IntegerField()
+    completed_time = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['statement_date', 'database', 'first_user_id'], name='unique_end_of_day_checkpoint'
+            )
+        ]
+
+    def __str__(self):
+        """
+        Return a string representation showing the date, database, and user range.
+        """
+        return f"{self.statement_date} - {self.database} [{self.first_user_id}, {self.last_user_id}]"
+
+
+class RiskLimit(ShardedModel):
+    """
+    Per-user overrides of the pre-trade risk limits in RISK_DEFAULT_LIMITS.
+    Empty fields fall back to the default. Stored on the same shard as its user.
+    """
+
+    shard_by = 'user'
+
+    user = models.OneToOneField(Users, on_delete=models.CASCADE, related_name='risk_limit')
+    max_order_notional = models.FloatField(null=True, blank=True)
+    max_ticker_exposure = models.FloatField(null=True, blank=True)
+    max_total_exposure = models.FloatField(null=True, blank=True)
+    max_daily_volume = models.FloatField(null=True, blank=True)
+    updated_time = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        """
+        Return a string representation showing the user the limits apply to.
+        """
+        return f"{self.user_id} - risk limits"
+
+
+class IdempotencyKey(models.Model):
+    """
+    The stored result of a request sent with an Idempotency-Key header, replayed to retries
+    until expires_at. Kept on the primary database.
+    """
+
+    scope = models.CharField(max_length=150)
+    key = models.CharField(max_length=255)
+    fingerprint = models.CharField(max_length=64)
+    response_status = models.PositiveSmallIntegerField(null=True, blank=True)
+    response_body = models.JSONField(null=True, blank=True, encoder=DjangoJSONEncoder)
+    created_time = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(db_index=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['scope', 'key'], name='unique_idempotency_key')
+        ]
+
+    def __str__(self):
+        """
+        Return a string representation showing the scope, key, and stored status.
+        """
+        return f"{self.scope} - {self.key} ({self.response_status})"
+
+
+class IdNode(models.Model):
+    """
+    One row per process that generates sharded ids; the row's id picks the node bits
+    of sharding.next_id so concurrently running processes never share them.
+    Stored on the primary database.
+    """
+
+    hostname = models.CharField(max_length=255)
+    pid = models.IntegerField()
+    claimed_time = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        """
+        Return a string representation showing the host and process id.
+        """
+        return f"{self.hostname}:{self.pid}"
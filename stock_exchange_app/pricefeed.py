@@ -0,0 +1,213 @@
+"""
+Coalescing ingestion of high-frequency price ticks.
+
+Ticks are kept in memory as the latest price per ticker (last write wins) and a
+background thread flushes the dirty tickers to the database every
+PRICE_FLUSH_INTERVAL seconds with a single bulk UPDATE per database, instead of
+one ORM save per tick.
+"""
+import logging
+import math
+import threading
+import time
+
+from django.conf import settings
+from django.db import connections
+from django.db.models import Case, FloatField, Value, When
+from django.utils.module_loading import import_string
+
+from .models import Stocks
+from .sharding import PRIMARY_DATABASE, shard_databases
+
+logger = logging.getLogger(__name__)
+
+# Tickers per UPDATE statement, to stay under database parameter limits.
+UPDATE_CHUNK_SIZE = 500
+
+ACCEPTED = 'accepted'
+MERGED = 'merged'
+DROPPED = 'dropped'
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+
+def bulk_update_prices(prices):
+    """
+    Write {ticker: price} with one `UPDATE ... SET stock_price = CASE ticker ... END` per chunk,
+    on the primary and on every shard replica. Returns the number of primary rows updated.
+    """
+    tickers = list(prices)
+    aliases = [PRIMARY_DATABASE] + [alias for alias in shard_databases() if alias != PRIMARY_DATABASE]
+    updated = 0
+    for start in range(0, len(tickers), UPDATE_CHUNK_SIZE):
+        chunk = tickers[start:start + UPDATE_CHUNK_SIZE]
+        new_price = Case(
+            *[When(ticker=ticker, then=Value(prices[ticker])) for ticker in chunk],
+            output_field=FloatField(),
+        )
+        for alias in aliases:
+            rows = Stocks.objects.using(alias).filter(ticker__in=chunk).update(stock_price=new_price)
+            if alias == PRIMARY_DATABASE:
+                updated += rows
+    return updated
+
+
+class PriceTickBuffer:
+    """
+    In-memory last-write-wins buffer of price ticks with a periodic bulk flush.
+
+    Listeners named in PRICE_FLUSH_LISTENERS or registered with `add_listener` are
+    called after every flush with the {ticker: price} mapping that was written.
+    """
+
+    def __init__(self, interval=None, max_pending=None):
+        self.interval = interval if interval is not None else settings.PRICE_FLUSH_INTERVAL
+        self.max_pending = max_pending if max_pending is not None else settings.PRICE_MAX_PENDING_TICKERS
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._oldest_pending = None
+        self._listeners = [import_string(path) for path in settings.PRICE_FLUSH_LISTENERS]
+        self._stop = threading.Event()
+        self._thread = None
+        self._metrics = {
+            'received': 0,
+            'merged': 0,
+            'dropped': 0,
+            'flushes': 0,
+            'flushed_tickers': 0,
+            'unknown_tickers': 0,
+            'flush_errors': 0,
+            'last_flush_lag_ms': None,
+            'max_flush_lag_ms': None,
+            'last_flush_duration_ms': None,
+        }
+
+    def submit(self, ticker, price):
+        """
+        Buffer one tick. Returns ACCEPTED, MERGED (replaced a pending price) or DROPPED.
+        """
+        valid = (
+            isinstance(ticker, str) and ticker
+            and isinstance(price, (int, float)) and not isinstance(price, bool)
+            and math.isfinite(price) and price > 0
+        )
+        with self._lock:
+            self._metrics['received'] += 1
+            if not valid:
+                self._metrics['dropped'] += 1
+                return DROPPED
+            if ticker in self._pending:
+                self._pending[ticker] = float(price)
+                self._metrics['merged'] += 1
+                return MERGED
+            if len(self._pending) >= self.max_pending:
+                self._metrics['dropped'] += 1
+                return DROPPED
+            self._pending[ticker] = float(price)
+            if self._oldest_pending is None:
+                self._oldest_pending = time.monotonic()
+            return ACCEPTED
+
+    def flush(self):
+        """
+        Write all pending prices to the database. Returns the number of stocks updated.
+        """
+        with self._lock:
+            prices, self._pending = self._pending, {}
+            oldest, self._oldest_pending = self._oldest_pending, None
+        if not prices:
+            return 0
+
+        started = time.monotonic()
+        try:
+            updated = bulk_update_prices(prices)
+        except Exception:
+            # Put the batch back unless newer ticks for the same tickers arrived meanwhile.
+            with self._lock:
+                for ticker, price in prices.items():
+                    self._pending.setdefault(ticker, price)
+                if self._oldest_pending is None or oldest < self._oldest_pending:
+                    self._oldest_pending = oldest
+                self._metrics['flush_errors'] += 1
+            raise
+
+        finished = time.monotonic()
+        lag_ms = (finished - oldest) * 1000
+        with self._lock:
+            metrics = self._metrics
+            metrics['flushes'] += 1
+            metrics['flushed_tickers'] += updated
+            metrics['unknown_tickers'] += len(prices) - updated
+            metrics['last_flush_lag_ms'] = lag_ms
+            metrics['max_flush_lag_ms'] = max(metrics['max_flush_lag_ms'] or 0.0, lag_ms)
+            metrics['last_flush_duration_ms'] = (finished - started) * 1000
+            listeners = list(self._listeners)
+
+        for listener in listeners:
+            try:
+                listener(prices)
+            except Exception:
+                logger.exception("Price flush listener %r failed", listener)
+        return updated
+
+    def add_listener(self, listener):
+        with self._lock:
+            self._listeners.append(listener)
+
+    def metrics(self):
+        """
+        Return a copy of the counters plus the current backlog.
+        """
+        with self._lock:
+            metrics = dict(self._metrics)
+            metrics['pending'] = len(self._pending)
+            metrics['oldest_pending_age_ms'] = (
+                (time.monotonic() - self._oldest_pending) * 1000 if self._oldest_pending is not None else None
+            )
+        metrics['flush_interval_ms'] = self.interval * 1000
+        return metrics
+
+    def start(self):
+        """
+        Start the background flush thread (idempotent).
+        """
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='price-tick-flusher', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stop the flush thread and write whatever is still pending.
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
+    def _run(self):
+        try:
+            while not self._stop.wait(self.interval):
+                try:
+                    self.flush()
+                except Exception:
+                    logger.exception("Price flush failed; retrying on the next interval")
+        finally:
+            connections.close_all()
+
+
+def get_buffer():
+    """
+    Return the process-wide tick buffer, starting its flush thread on first use.
+    """
+    global _buffer
+    if _buffer is None:
+        with _buffer_lock:
+            if _buffer is None:
+                price_buffer = PriceTickBuffer()
+                price_buffer.start()
+                _buffer = price_buffer
+    return _buffer
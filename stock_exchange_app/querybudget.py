@@ -0,0 +1,172 @@
+"""
+Query budgets: declare how many SQL queries a view or admin page may run.
+
+`query_budget` works as a decorator or context manager and raises
+QueryBudgetExceeded when the block runs more queries than allowed. Views are
+only checked while QUERY_BUDGET_ENFORCE is on (DEBUG by default); tests can use
+`assert_max_queries`, which always checks.
+
+RepeatedQueryMiddleware is a development aid that logs SQL statements repeated
+within one request, the usual sign of an N+1 query.
+
+Transaction control (BEGIN, savepoints) is not counted: it depends on how atomic
+blocks nest, e.g. under TestCase, not on what the code reads or writes.
+"""
+import logging
+from collections import Counter
+from contextlib import ContextDecorator, ExitStack
+
+from django.conf import settings
+from django.db import connections
+
+from .sharding import PRIMARY_DATABASE, shard_databases
+
+logger = logging.getLogger(__name__)
+
+
+class QueryBudgetExceeded(AssertionError):
+    """
+    Raised when a block runs more SQL queries than its budget allows.
+    """
+
+
+# First keyword of statements that only open, close or roll back transactions and savepoints.
+TRANSACTION_CONTROL = frozenset({'BEGIN', 'COMMIT', 'ROLLBACK', 'SAVEPOINT', 'RELEASE'})
+
+
+def _database_aliases():
+    return [PRIMARY_DATABASE] + [alias for alias in shard_databases() if alias != PRIMARY_DATABASE]
+
+
+class QueryRecorder:
+    """
+    Records the SQL (without parameters) of every query run on the given databases in this thread,
+    except transaction control statements.
+    """
+
+    def __init__(self, aliases=None):
+        self.aliases = aliases or _database_aliases()
+        self.queries = []
+        self._stack = None
+
+    def __call__(self, execute, sql, params, many, context):
+        keyword = sql.split(None, 1)[0].upper() if sql.strip() else ''
+        if keyword not in TRANSACTION_CONTROL:
+            self.queries.append((context['connection'].alias, sql))
+        return execute(sql, params, many, context)
+
+    def __enter__(self):
+        self._stack = ExitStack()
+        for alias in self.aliases:
+            self._stack.enter_context(connections[alias].execute_wrapper(self))
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stack.close()
+        return False
+
+    def repeated(self, threshold):
+        """
+        Return [(alias, sql, count)] for statements run at least `threshold` times on one database.
+
+        The same statement run once on each shard is a planned fan-out, not an N+1 query.
+        """
+        counts = Counter(self.queries)
+        return [(alias, sql, count) for (alias, sql), count in counts.most_common() if count >= threshold]
+
+
+class query_budget(ContextDecorator):
+    """
+    Fail when the wrapped view or block runs more than `max_queries` SQL queries.
+
+    `per_shard` adds that many queries per database in SHARD_DATABASES, for
+    lookups that fan out across shards. `enforce=None` follows QUERY_BUDGET_ENFORCE.
+    """
+
+    def __init__(self, max_queries, per_shard=0, label=None, enforce=None):
+        self.max_queries = max_queries
+        self.per_shard = per_shard
+        self.label = label
+        self.enforce = enforce
+        self._recorder = None
+
+    def _recreate_cm(self):
+        # A fresh instance per call keeps concurrent requests from sharing a recorder.
+        return type(self)(self.max_queries, self.per_shard, self.label, self.enforce)
+
+    def __call__(self, func):
+        if self.label is None:
+            self.label = func.__qualname__
+        return super().__call__(func)
+
+    @property
+    def budget(self):
+        return self.max_queries + self.per_shard * len(shard_databases())
+
+    def __enter__(self):
+        enforce = self.enforce if self.enforce is not None else settings.QUERY_BUDGET_ENFORCE
+        if enforce:
+            self._recorder = QueryRecorder().__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        recorder, self._recorder = self._recorder, None
+        if recorder is None:
+            return False
+        recorder.__exit__(exc_type, exc_value, traceback)
+        if exc_type is None and len(recorder.queries) > self.budget:
+            statements = "\n".join(f"  [{alias}] {sql}" for alias, sql in recorder.queries)
+            raise QueryBudgetExceeded(
+                f"{self.label or 'block'} ran {len(recorder.queries)} queries; budget is {self.budget}:\n{statements}"
+            )
+        return False
+
+
+def assert_max_queries(max_queries, per_shard=0, label=None):
+    """
+    Test helper: `with assert_max_queries(3): client.get(...)` fails if more than 3 queries run.
+    """
+    return query_budget(max_queries, per_shard=per_shard, label=label, enforce=True)
+
+
+class QueryBudgetAdminMixin:
+    """
+    ModelAdmin mixin enforcing `changelist_query_budget` on the changelist page.
+    """
+
+    changelist_query_budget = None
+
+    def changelist_view(self, request, extra_context=None):
+        if self.changelist_query_budget is None:
+            return super().changelist_view(request, extra_context)
+
+        label = f"{self.model._meta.label} admin changelist"
+        with query_budget(self.changelist_query_budget, label=label):
+            response = super().changelist_view(request, extra_context)
+            # The changelist is a TemplateResponse; render it so template queries are counted.
+            if hasattr(response, 'render'):
+                response.render()
+        return response
+
+
+class RepeatedQueryMiddleware:
+    """
+    Development middleware that logs statements repeated QUERY_REPEAT_THRESHOLD or more
+    times on one database in one request and reports them in the X-Repeated-Queries header.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with QueryRecorder() as recorder:
+            response = self.get_response(request)
+
+        repeated = recorder.repeated(settings.QUERY_REPEAT_THRESHOLD)
+        response['X-Query-Count'] = str(len(recorder.queries))
+        if repeated:
+            response['X-Repeated-Queries'] = str(sum(count for _, _, count in repeated))
+            for alias, sql, count in repeated:
+                logger.warning("%s %s repeated the same query %d times on %s: %s",
+                               request.method, request.path, count, alias, sql)
+        return response
@@ -0,0 +1,402 @@
+"""
+Pre-trade risk checks that run entirely in memory.
+
+For every user the RiskEngine keeps the net notional position per ticker (buys
+minus sells at trade price), the gross exposure across tickers and the volume
+traded today. The state is built once per process from Transaction aggregates
+and updated as trades commit, so `check` never touches the database.
+
+`reserve` checks a trade and holds its amounts until it commits (`record`) or
+rolls back (`release`), so concurrent trades of one user cannot all pass against
+the same numbers. Held trades count at their worst case for the trade checked.
+
+A background thread re-syncs every RISK_SYNC_INTERVAL seconds to pick up trades
+committed by other processes and changed RiskLimit rows, so limits can be
+changed without a restart.
+"""
+import itertools
+import logging
+import math
+import threading
+import time
+from collections import defaultdict, namedtuple
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import DatabaseError, connections
+from django.db.models import Case, Count, F, FloatField, Q, Sum, Value, When
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import RiskLimit, Transaction
+from .sharding import shard_databases
+from .statements import day_bounds
+
+logger = logging.getLogger(__name__)
+
+LIMIT_FIELDS = ('max_order_notional', 'max_ticker_exposure', 'max_total_exposure', 'max_daily_volume')
+RiskLimits = namedtuple('RiskLimits', LIMIT_FIELDS)
+
+# Trades created this long before the last sync are read again in case they committed late.
+SYNC_OVERLAP = timedelta(seconds=5)
+
+# Reservations neither recorded nor released within this many seconds are dropped by
+# `sync`; this covers a trade rolled back by an outer transaction after execute_trade returned.
+RESERVATION_TIMEOUT = 30.0
+
+TRADE_FIELDS = ('pk', 'user_id', 'ticker_id', 'transaction_type', 'transaction_volume',
+                'transaction_price', 'created_time')
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def default_limits():
+    """
+    Return RISK_DEFAULT_LIMITS as RiskLimits, with unset limits as infinity.
+    """
+    configured = settings.RISK_DEFAULT_LIMITS
+    return RiskLimits(*(
+        math.inf if configured.get(name) is None else configured[name] for name in LIMIT_FIELDS
+    ))
+
+
+class RiskEngine:
+    """
+    In-memory exposure and daily volume per user, checked against per-user limits.
+    """
+
+    def __init__(self, default=None):
+        self.default_limits = default if default is not None else default_limits()
+        self.loaded = False
+        self._limits = {}
+        self._positions = {}
+        self._exposure = defaultdict(float)
+        self._daily_volume = defaultdict(float)
+        # Trades already applied, by pk, so re-reads inside SYNC_OVERLAP are not counted twice.
+        self._seen = {}
+        self._synced_since = None
+        # Held amounts of checked trades that have not committed yet, by reservation token.
+        self._reservations = {}
+        self._reservation_ids = itertools.count(1)
+        self._reserved_buys = defaultdict(float)
+        self._reserved_sells = defaultdict(float)
+        self._reserved_notional = defaultdict(float)
+        self._reserved_volume = defaultdict(float)
+        # user_ids with a RiskLimit row, per database, to notice deleted or moved rows.
+        self._limit_users = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._start_day()
+
+    def _start_day(self):
+        self._day_start, day_end = day_bounds(timezone.localdate())
+        self._day_end_ts = day_end.timestamp()
+        self._daily_volume.clear()
+
+    def set_limits(self, user_id, values):
+        """
+        Override the limits of one user; None values fall back to the default.
+        """
+        limits = self._with_defaults(values)
+        with self._lock:
+            self._limits[user_id] = limits
+
+    def clear_limits(self, user_id):
+        with self._lock:
+            self._limits.pop(user_id, None)
+
+    def check(self, user_id, ticker_id, transaction_type, volume, notional):
+        """
+        Return why the trade would breach the user's limits, or None if it is allowed.
+        Exposure limits only reject trades that increase the exposure.
+        """
+        with self._lock:
+            return self._check(user_id, ticker_id, transaction_type, volume, notional)
+
+    def reserve(self, user_id, ticker_id, transaction_type, volume, notional):
+        """
+        Check the trade and, if it is allowed, hold its amounts against the user's limits.
+        Return (reason, None) for a rejected trade and (None, token) otherwise; pass the
+        token to `record` once the trade commits or to `release` if it does not.
+        """
+        with self._lock:
+            reason = self._check(user_id, ticker_id, transaction_type, volume, notional)
+            if reason:
+                return reason, None
+            token = next(self._reservation_ids)
+            reservation = (user_id, ticker_id, transaction_type, volume, notional)
+            self._reservations[token] = (reservation, time.monotonic() + RESERVATION_TIMEOUT)
+            self._hold(*reservation, sign=1)
+            return None, token
+
+    def release(self, token):
+        """
+        Drop a reservation whose trade did not commit.
+        """
+        with self._lock:
+            self._release(token)
+
+    def _release(self, token):
+        held = self._reservations.pop(token, None)
+        if held is not None:
+            self._hold(*held[0], sign=-1)
+
+    def _hold(self, user_id, ticker_id, transaction_type, volume, notional, sign):
+        key = (user_id, ticker_id)
+        if transaction_type == 'BUY':
+            self._reserved_buys[key] += sign * notional
+        else:
+            self._reserved_sells[key] += sign * notional
+        self._reserved_notional[user_id] += sign * notional
+        self._reserved_volume[user_id] += sign * volume
+
+    def _check(self, user_id, ticker_id, transaction_type, volume, notional):
+        # A negative trade would lower the daily volume and exposure it is checked against.
+        if not volume > 0 or not notional > 0:
+            return "Volume and notional must be positive"
+        if time.time() >= self._day_end_ts:
+            # Daily volumes restart at local midnight.
+            self._start_day()
+        limits = self._limits.get(user_id, self.default_limits)
+        key = (user_id, ticker_id)
+        position = self._positions.get(key, 0.0)
+        # Held trades may all commit: count those in this trade's direction on the
+        # position, and all of them as extra exposure.
+        if transaction_type == 'BUY':
+            position += self._reserved_buys.get(key, 0.0)
+        else:
+            position -= self._reserved_sells.get(key, 0.0)
+        exposure = self._exposure.get(user_id, 0.0) + self._reserved_notional.get(user_id, 0.0)
+        daily_volume = self._daily_volume.get(user_id, 0.0) + self._reserved_volume.get(user_id, 0.0) + volume
+
+        if notional > limits.max_order_notional:
+            return f"Order notional {notional:.2f} exceeds the limit of {limits.max_order_notional:.2f}"
+        if daily_volume > limits.max_daily_volume:
+            return f"Daily volume {daily_volume:g} would exceed the limit of {limits.max_daily_volume:g}"
+
+        new_position = position + notional if transaction_type == 'BUY' else position - notional
+        if abs(new_position) > limits.max_ticker_exposure and abs(new_position) > abs(position):
+            return (f"Exposure to this stock {abs(new_position):.2f} would exceed the limit "
+                    f"of {limits.max_ticker_exposure:.2f}")
+        new_exposure = exposure - abs(position) + abs(new_position)
+        if new_exposure > limits.max_total_exposure and new_exposure > exposure:
+            return f"Total exposure {new_exposure:.2f} would exceed the limit of {limits.max_total_exposure:.2f}"
+        return None
+
+    def apply_trade(self, pk, user_id, ticker_id, transaction_type, volume, notional, created_time):
+        """
+        Add one trade to the running exposure and daily volume, once per pk.
+        """
+        with self._lock:
+            self._apply_trade(pk, user_id, ticker_id, transaction_type, volume, notional, created_time)
+
+    def _apply_trade(self, pk, user_id, ticker_id, transaction_type, volume, notional, created_time):
+        if pk in self._seen:
+            return
+        self._seen[pk] = created_time
+
+        key = (user_id, ticker_id)
+        position = self._positions.get(key, 0.0)
+        new_position = position + notional if transaction_type == 'BUY' else position - notional
+        self._positions[key] = new_position
+        self._exposure[user_id] += abs(new_position) - abs(position)
+        if created_time >= self._day_start:
+            self._daily_volume[user_id] += volume
+
+    def record(self, trade, token=None):
+        """
+        Apply a committed Transaction and drop its reservation.
+        Called from transaction.on_commit in execute_trade.
+        """
+        with self._lock:
+            self._apply_trade(trade.pk, trade.user_id, trade.ticker_id, trade.transaction_type,
+                              trade.transaction_volume, trade.transaction_price, trade.created_time)
+            self._release(token)
+
+    def load(self):
+        """
+        Rebuild the state from every shard: one aggregate query for trades older than
+        SYNC_OVERLAP, the recent trades row by row, and the RiskLimit rows.
+        """
+        started = timezone.now()
+        cutoff = started - SYNC_OVERLAP
+        net_notional = Sum(Case(
+            When(transaction_type='BUY', then=F('transaction_price')),
+            default=-F('transaction_price'),
+            output_field=FloatField(),
+        ))
+
+        with self._lock:
+            self._start_day()
+            self._positions.clear()
+            self._exposure.clear()
+            self._seen.clear()
+            self._limits.clear()
+            self._limit_users.clear()
+
+            for alias in shard_databases():
+                transactions = Transaction.objects.using(alias)
+                totals = (
+                    transactions.filter(created_time__lt=cutoff)
+                    .values('user_id', 'ticker_id')
+                    .annotate(net=net_notional, today=Coalesce(
+                        Sum('transaction_volume', filter=Q(created_time__gte=self._day_start)),
+                        Value(0.0),
+                        output_field=FloatField(),
+                    ))
+                    .values_list('user_id', 'ticker_id', 'net', 'today')
+                )
+                for user_id, ticker_id, net, today in totals.iterator(chunk_size=10000):
+                    self._positions[(user_id, ticker_id)] = net
+                    self._exposure[user_id] += abs(net)
+                    if today:
+                        self._daily_volume[user_id] += today
+
+                recent = transactions.filter(created_time__gte=cutoff).values_list(*TRADE_FIELDS)
+                for row in recent:
+                    self._apply_trade(*row)
+
+                self._apply_limits(alias, self._limit_rows(alias), full=True)
+
+            self._synced_since = started
+            self.loaded = True
+
+    def _with_defaults(self, values):
+        return RiskLimits(*(
+            default if value is None else value for value, default in zip(values, self.default_limits)
+        ))
+
+    def _limit_rows(self, alias, since=None):
+        limits = RiskLimit.objects.using(alias)
+        if since is not None:
+            limits = limits.filter(updated_time__gte=since)
+        return list(limits.values_list('user_id', *LIMIT_FIELDS))
+
+    def _apply_limits(self, alias, rows, full=False):
+        """
+        Apply RiskLimit rows read from `alias`. With `full`, `rows` are all of its rows
+        and users whose row is gone from every database return to the defaults.
+        Call with the lock held.
+        """
+        users = {user_id for user_id, *_ in rows}
+        if full:
+            others = set().union(*(ids for other, ids in self._limit_users.items() if other != alias))
+            for user_id in self._limit_users.get(alias, set()) - users - others:
+                self._limits.pop(user_id, None)
+            self._limit_users[alias] = users
+        else:
+            self._limit_users.setdefault(alias, set()).update(users)
+        for user_id, *values in rows:
+            self._limits[user_id] = self._with_defaults(values)
+
+    def _sync_limits(self, alias, since):
+        """
+        Apply the RiskLimit rows changed since `since`. Deletes (and rows moved here by
+        rebalance_shards, which keep their updated_time) change the count or sum of
+        user_ids on the database; only then are all of its rows read again.
+        """
+        rows = self._limit_rows(alias, since)
+        members = RiskLimit.objects.using(alias).aggregate(count=Count('pk'), total=Sum('user_id'))
+        with self._lock:
+            self._apply_limits(alias, rows)
+            users = self._limit_users[alias]
+            if (members['count'], members['total'] or 0) == (len(users), sum(users)):
+                return
+        rows = self._limit_rows(alias)
+        with self._lock:
+            self._apply_limits(alias, rows, full=True)
+
+    def sync(self):
+        """
+        Apply trades committed by other processes and RiskLimit rows changed since the
+        last sync, and drop reservations that were never recorded or released.
+        """
+        started = timezone.now()
+        since = self._synced_since - SYNC_OVERLAP
+        for alias in shard_databases():
+            rows = list(Transaction.objects.using(alias).filter(created_time__gte=since).values_list(*TRADE_FIELDS))
+            with self._lock:
+                if time.time() >= self._day_end_ts:
+                    self._start_day()
+                for row in rows:
+                    self._apply_trade(*row)
+            self._sync_limits(alias, since)
+
+        with self._lock:
+            self._synced_since = started
+            horizon = started - SYNC_OVERLAP
+            self._seen = {pk: created_time for pk, created_time in self._seen.items() if created_time >= horizon}
+            now = time.monotonic()
+            for token in [token for token, (_, deadline) in self._reservations.items() if deadline <= now]:
+                self._release(token)
+
+    def start(self):
+        """
+        Start the background sync thread (idempotent).
+        """
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='risk-sync', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        try:
+            while not self._stop.wait(settings.RISK_SYNC_INTERVAL):
+                try:
+                    self.sync()
+                except Exception:
+                    logger.exception("Risk state sync failed; retrying on the next interval")
+        finally:
+            connections.close_all()
+
+
+def get_engine():
+    """
+    Return the process-wide risk engine, loading it and starting its sync thread on first use.
+    """
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                engine = RiskEngine()
+                engine.load()
+                engine.start()
+                _engine = engine
+    return _engine
+
+
+def warm_up():
+    """
+    Load the engine at server startup so the first trade does not pay for it.
+    If the database is not ready the engine is loaded by the first trade instead.
+    """
+    try:
+        get_engine()
+    except DatabaseError:
+        logger.warning("Risk engine not loaded at startup; it will load on the first trade", exc_info=True)
+
+
+def limits_saved(sender, instance, **kwargs):
+    """
+    post_save handler applying a RiskLimit change to this process at once.
+    Other processes pick it up on their next sync.
+    """
+    if _engine is not None:
+        _engine.set_limits(instance.user_id, [getattr(instance, name) for name in LIMIT_FIELDS])
+
+
+def limits_deleted(sender, instance, **kwargs):
+    """
+    post_delete handler returning the user to the default limits in this process.
+    """
+    if _engine is not None:
+        _engine.clear_limits(instance.user_id)
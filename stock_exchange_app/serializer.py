@@ -1,8 +1,9 @@
 from django.contrib.auth import authenticate
 from rest_framework import serializers
 from django.contrib.auth.models import User
-from stock_exchange_app.models import Users, Stocks, Transaction
+from stock_exchange_app.models import Users, Stocks, Transaction, ConditionalOrder
 from django.contrib.auth.hashers import make_password
+from stock_exchange_app.sharding import username_exists
 
 
 class RegisterSerializer(serializers.ModelSerializer):
@@ -73,6 +74,16 @@ class UserSerializer(serializers.ModelSerializer):
     class Meta:
         model = Users
         fields = ['username', 'balance']
+        # The model's unique validator only checks the username's home shard; see validate_username.
+        extra_kwargs = {'username': {'validators': []}}
+
+    def validate_username(self, value):
+        """
+        Ensure the username is not taken on any shard, including by a user not rebalanced yet.
+        """
+        if username_exists(value):
+            raise serializers.ValidationError("users with this username already exists.")
+        return value
 
 
 class StockSerializer(serializers.ModelSerializer):
@@ -84,6 +95,14 @@ class StockSerializer(serializers.ModelSerializer):
         fields = ['ticker', 'stock_price', 'stock_name']
 
 
+class PriceTickSerializer(serializers.Serializer):
+    """
+    Serializer documenting one price tick for the price ingestion endpoint.
+    """
+    ticker = serializers.CharField()
+    stock_price = serializers.FloatField()
+
+
 class TransactionSerializer(serializers.ModelSerializer):
     """
     Serializer for Transaction model with read-only 'created_time' field.
@@ -92,3 +111,14 @@ class TransactionSerializer(serializers.ModelSerializer):
         model = Transaction
         fields = ['user', 'ticker', 'transaction_price', 'transaction_type', 'transaction_volume', 'created_time']
         read_only_fields = ['created_time']
+
+
+class ConditionalOrderSerializer(serializers.ModelSerializer):
+    """
+    Serializer for ConditionalOrder model with read-only execution state.
+    """
+    class Meta:
+        model = ConditionalOrder
+        fields = ['id', 'user', 'ticker', 'order_type', 'transaction_type', 'transaction_volume', 'trigger_price',
+                  'direction', 'status', 'status_reason', 'transaction', 'created_time', 'triggered_time']
+        read_only_fields = ['direction', 'status', 'status_reason', 'transaction', 'created_time', 'triggered_time']
@@ -0,0 +1,367 @@
+"""
+Horizontal sharding of user data across several database aliases.
+
+`Users` rows and every row that belongs to a user (`Transaction`, ...) live on
+one of `settings.SHARD_DATABASES`, chosen by a consistent hash of the username.
+Reference data such as `Stocks` is written to PRIMARY_DATABASE and replicated
+to every other shard so foreign keys stay local to a shard.
+
+Models opt in with class attributes:
+
+    shard_by = 'username'   # the model is sharded on its own username field
+    shard_by = 'user'       # the model follows the shard of its `user` foreign key
+    replicated = True       # the model is copied to every shard
+
+With a single database in SHARD_DATABASES everything behaves as before.
+"""
+import bisect
+import hashlib
+import logging
+import os
+import socket
+import threading
+import time
+
+from django.conf import settings
+from django.db import DatabaseError, connections, models, transaction
+
+logger = logging.getLogger(__name__)
+
+PRIMARY_DATABASE = 'default'
+
+# Custom epoch (2024-01-01 UTC) for globally unique ids, in milliseconds.
+ID_EPOCH_MS = 1704067200000
+# Ids have 10 node bits. Claimed node ids cycle through 1-1023; 0 is only used
+# while `migrate` runs before the IdNode table exists.
+NODE_COUNT = 1024
+
+_rings = {}
+_id_lock = threading.Lock()
+_id_state = {'pid': None, 'node': 0, 'last_ms': 0, 'sequence': 0}
+
+
+def _hash(key):
+    return int.from_bytes(hashlib.md5(key.encode('utf-8')).digest()[:8], 'big')
+
+
+class HashRing:
+    """
+    Consistent-hash ring mapping keys onto database aliases.
+
+    Each alias is placed on the ring `replicas` times so that adding or removing
+    a shard only moves roughly 1/N of the keys.
+    """
+
+    def __init__(self, nodes, replicas=64):
+        self.nodes = list(nodes)
+        points = sorted(
+            (_hash(f'{node}#{replica}'), node)
+            for node in self.nodes
+            for replica in range(replicas)
+        )
+        self._keys = [point for point, _ in points]
+        self._nodes = [node for _, node in points]
+
+    def get_node(self, key):
+        """
+        Return the alias owning the given key.
+        """
+        if len(self.nodes) == 1:
+            return self.nodes[0]
+        index = bisect.bisect(self._keys, _hash(key)) % len(self._keys)
+        return self._nodes[index]
+
+
+def shard_databases():
+    """
+    Return the list of database aliases holding user data.
+    """
+    return list(getattr(settings, 'SHARD_DATABASES', [PRIMARY_DATABASE]))
+
+
+def is_sharded():
+    return len(shard_databases()) > 1
+
+
+def get_ring():
+    nodes = tuple(shard_databases())
+    ring = _rings.get(nodes)
+    if ring is None:
+        ring = _rings[nodes] = HashRing(nodes, getattr(settings, 'SHARD_VIRTUAL_NODES', 64))
+    return ring
+
+
+def shard_for_username(username):
+    """
+    Return the database alias that owns the given username.
+    """
+    return get_ring().get_node(username)
+
+
+def _claim_node_id():
+    """
+    Return this process's node id: SHARD_NODE_ID if configured, otherwise one derived
+    from a new IdNode row on the primary database. Primary keys are never reused, so
+    processes only share a node id after 1023 other processes have claimed one since.
+    """
+    if settings.SHARD_NODE_ID is not None:
+        if not 0 <= settings.SHARD_NODE_ID < NODE_COUNT:
+            raise ValueError(f"SHARD_NODE_ID must be between 0 and {NODE_COUNT - 1}.")
+        return settings.SHARD_NODE_ID
+
+    from .models import IdNode
+
+    try:
+        with transaction.atomic(using=PRIMARY_DATABASE):
+            node = IdNode.objects.using(PRIMARY_DATABASE).create(hostname=socket.gethostname(), pid=os.getpid())
+    except DatabaseError:
+        if IdNode._meta.db_table in connections[PRIMARY_DATABASE].introspection.table_names():
+            raise
+        # Data migrations that run before the IdNode table is created.
+        return 0
+    return 1 + (node.pk - 1) % (NODE_COUNT - 1)
+
+
+def claim_node_id():
+    """
+    Claim this process's node id at server startup rather than in the first request
+    that creates a sharded row. If the database is not ready it is claimed then instead.
+    """
+    if not is_sharded():
+        return
+    try:
+        with _id_lock:
+            _ensure_node_id()
+    except DatabaseError:
+        logger.warning("Id node not claimed at startup; it will be claimed on first use", exc_info=True)
+
+
+def _ensure_node_id():
+    pid = os.getpid()
+    if _id_state['pid'] != pid:
+        # Claimed per process, including forked workers.
+        _id_state.update(pid=pid, node=_claim_node_id(), last_ms=0, sequence=0)
+
+
+def username_exists(username):
+    """
+    Return whether a user with this username exists on any shard. Users stay on their
+    old shard until rebalance_shards moves them, so the home shard alone is not enough.
+    """
+    from .models import Users
+
+    home = shard_for_username(username)
+    aliases = [home] + [alias for alias in shard_databases() if alias != home]
+    return any(Users.objects.using(alias).filter(username=username).exists() for alias in aliases)
+
+
+def next_id():
+    """
+    Return a globally unique 63-bit id (timestamp | node | sequence).
+
+    Sharded rows cannot rely on per-database auto increment because rows are
+    moved between shards by `rebalance_shards`.
+    """
+    with _id_lock:
+        _ensure_node_id()
+        now_ms = int(time.time() * 1000) - ID_EPOCH_MS
+        if now_ms <= _id_state['last_ms']:
+            now_ms = _id_state['last_ms']
+            _id_state['sequence'] = (_id_state['sequence'] + 1) & 0xFFF
+            if _id_state['sequence'] == 0:
+                now_ms += 1
+        else:
+            _id_state['sequence'] = 0
+        _id_state['last_ms'] = now_ms
+        return (now_ms << 22) | (_id_state['node'] << 12) | _id_state['sequence']
+
+
+def user_owned_models():
+    """
+    Return the models that follow the shard of their `user` foreign key.
+    """
+    from django.apps import apps
+
+    return [
+        model for model in apps.get_app_config('stock_exchange_app').get_models()
+        if getattr(model, 'shard_by', None) == 'user'
+    ]
+
+
+def replicated_models():
+    from django.apps import apps
+
+    return [
+        model for model in apps.get_app_config('stock_exchange_app').get_models()
+        if getattr(model, 'replicated', False)
+    ]
+
+
+def user_id_ranges(alias, size):
+    """
+    Split the users on one database into (first_pk, last_pk) ranges of at most `size` users.
+    """
+    from .models import Users
+
+    pks = list(Users.objects.using(alias).order_by('pk').values_list('pk', flat=True))
+    return [(pks[start], pks[min(start + size, len(pks)) - 1]) for start in range(0, len(pks), size)]
+
+
+def shard_for_instance(instance):
+    """
+    Return the shard of a model instance, or None if it cannot be determined.
+    """
+    if instance._state.db:
+        return instance._state.db
+
+    shard_by = getattr(type(instance), 'shard_by', None)
+    if shard_by == 'username':
+        return shard_for_username(instance.username)
+    if shard_by == 'user' and type(instance).user.is_cached(instance):
+        return shard_for_instance(instance.user)
+    return None
+
+
+def shard_for_lookup(model, lookup):
+    """
+    Return the shard targeted by filter keyword arguments, or None if they do not pin one.
+    """
+    shard_by = getattr(model, 'shard_by', None)
+    if shard_by == 'username':
+        username = lookup.get('username', lookup.get('username__exact'))
+    elif shard_by == 'user':
+        user = lookup.get('user', lookup.get('user__exact'))
+        if isinstance(user, models.Model):
+            return shard_for_instance(user)
+        username = lookup.get('user__username', lookup.get('user__username__exact'))
+    else:
+        return None
+
+    if isinstance(username, str):
+        return shard_for_username(username)
+    return None
+
+
+class ShardedQuerySet(models.QuerySet):
+    """
+    QuerySet that sends lookups on the shard key to the shard owning the rows.
+
+    `get()` without a usable shard key (e.g. by primary key) asks every shard in
+    turn; this also covers users whose rows are still being rebalanced.
+    """
+
+    def _routed(self, lookup):
+        if self._db is not None or not is_sharded():
+            return self
+        alias = shard_for_lookup(self.model, lookup)
+        return self.using(alias) if alias else self
+
+    def filter(self, *args, **kwargs):
+        return super(ShardedQuerySet, self._routed(kwargs)).filter(*args, **kwargs)
+
+    def create(self, **kwargs):
+        return super(ShardedQuerySet, self._routed(kwargs)).create(**kwargs)
+
+    def get(self, *args, **kwargs):
+        if self._db is not None or not is_sharded():
+            return super().get(*args, **kwargs)
+
+        home = shard_for_lookup(self.model, kwargs)
+        aliases = shard_databases()
+        if home:
+            aliases = [home] + [alias for alias in aliases if alias != home]
+
+        for alias in aliases:
+            try:
+                return super(ShardedQuerySet, self.using(alias)).get(*args, **kwargs)
+            except self.model.DoesNotExist:
+                continue
+        raise self.model.DoesNotExist(
+            "%s matching query does not exist." % self.model._meta.object_name
+        )
+
+
+class ShardedModel(models.Model):
+    """
+    Abstract base for sharded models: assigns globally unique primary keys when sharding is enabled.
+    """
+
+    objects = ShardedQuerySet.as_manager()
+
+    class Meta:
+        abstract = True
+
+    def save(self, *args, **kwargs):
+        if self.pk is None and is_sharded():
+            self.pk = next_id()
+        super().save(*args, **kwargs)
+
+
+class ShardRouter:
+    """
+    Database router for SHARD_DATABASES. See the module docstring.
+    """
+
+    def _db_for_model(self, model, instance=None):
+        if not is_sharded():
+            return None
+
+        if getattr(model, 'shard_by', None) or getattr(model, 'replicated', False):
+            # Related lookups stay on the shard of the instance they start from.
+            if instance is not None:
+                alias = shard_for_instance(instance)
+                if alias:
+                    return alias
+        return PRIMARY_DATABASE
+
+    def db_for_read(self, model, **hints):
+        return self._db_for_model(model, hints.get('instance'))
+
+    def db_for_write(self, model, **hints):
+        instance = hints.get('instance')
+        if getattr(model, 'replicated', False):
+            # Replicated rows are only written on the primary; signals copy them.
+            if instance is None or instance._state.db in (None, PRIMARY_DATABASE):
+                return PRIMARY_DATABASE
+        return self._db_for_model(model, instance)
+
+    def allow_relation(self, obj1, obj2, **hints):
+        if getattr(type(obj1), 'replicated', False) or getattr(type(obj2), 'replicated', False):
+            return True
+        if obj1._state.db == obj2._state.db:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db not in shard_databases() or db == PRIMARY_DATABASE:
+            return None
+        return app_label == 'stock_exchange_app'
+
+
+def replicate_instance(sender, instance, raw=False, **kwargs):
+    """
+    post_save handler copying a replicated row from the primary to every other shard.
+    """
+    if raw or not is_sharded() or instance._state.db != PRIMARY_DATABASE:
+        return
+
+    values = {
+        field.attname: getattr(instance, field.attname)
+        for field in sender._meta.concrete_fields
+        if not field.primary_key
+    }
+    for alias in shard_databases():
+        if alias != PRIMARY_DATABASE:
+            sender._default_manager.using(alias).update_or_create(pk=instance.pk, defaults=values)
+
+
+def delete_replicas(sender, instance, **kwargs):
+    """
+    post_delete handler removing a replicated row from every other shard.
+    """
+    if not is_sharded() or instance._state.db != PRIMARY_DATABASE:
+        return
+
+    for alias in shard_databases():
+        if alias != PRIMARY_DATABASE:
+            sender._default_manager.using(alias).filter(pk=instance.pk).delete()
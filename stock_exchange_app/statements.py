@@ -0,0 +1,91 @@
+"""
+End-of-day statements: per-user, per-ticker trading totals and closing balances.
+
+`build_statements` handles one range of users on one database with a single
+aggregate query over the day's transactions and one over later ledger entries,
+and replaces that range's DailyStatement rows with `bulk_create`.
+"""
+from datetime import datetime, time, timedelta
+
+from django.db import transaction
+from django.db.models import Count, FloatField, Q, Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .ledger import signed_amount
+from .models import DailyStatement, EndOfDayCheckpoint, Transaction, Users
+from .sharding import PRIMARY_DATABASE, is_sharded, next_id
+
+
+def day_bounds(statement_date):
+    """
+    Return the [start, end) datetimes of a date in the current time zone.
+    """
+    start = timezone.make_aware(datetime.combine(statement_date, time.min))
+    return start, start + timedelta(days=1)
+
+
+def build_statements(alias, statement_date, first_user_id, last_user_id):
+    """
+    Write the DailyStatement rows for users first_user_id..last_user_id on `alias`
+    and record a checkpoint for the range. Safe to re-run for the same range.
+    :return: Number of statement rows written.
+    """
+    day_start, day_end = day_bounds(statement_date)
+    users_in_range = Q(user_id__gte=first_user_id, user_id__lte=last_user_id)
+
+    totals = (
+        Transaction.objects.using(alias)
+        .filter(users_in_range, created_time__gte=day_start, created_time__lt=day_end)
+        .values('user_id', 'ticker_id')
+        .annotate(trade_count=Count('pk'), volume=Sum('transaction_volume'), notional=Sum('transaction_price'))
+    )
+
+    # Closing balance = current balance minus everything booked after the day ended.
+    balances = (
+        Users.objects.using(alias)
+        .filter(pk__gte=first_user_id, pk__lte=last_user_id)
+        .annotate(booked_after=Coalesce(
+            Sum(signed_amount('ledger_entries__'), filter=Q(ledger_entries__created_time__gte=day_end)),
+            Value(0.0),
+            output_field=FloatField(),
+        ))
+        .values_list('pk', 'balance', 'booked_after')
+    )
+    closing_balances = {pk: balance - booked_after for pk, balance, booked_after in balances}
+
+    statements = [
+        DailyStatement(
+            user_id=row['user_id'],
+            statement_date=statement_date,
+            ticker_id=row['ticker_id'],
+            trade_count=row['trade_count'],
+            volume=row['volume'],
+            notional=row['notional'],
+            closing_balance=closing_balances.get(row['user_id'], 0.0),
+        )
+        for row in totals
+    ]
+    traded = {statement.user_id for statement in statements}
+    statements.extend(
+        DailyStatement(user_id=user_id, statement_date=statement_date, closing_balance=closing_balance)
+        for user_id, closing_balance in closing_balances.items()
+        if user_id not in traded
+    )
+    if is_sharded():
+        # bulk_create bypasses ShardedModel.save, so assign the global ids here.
+        for statement in statements:
+            statement.pk = next_id()
+
+    with transaction.atomic(using=alias):
+        DailyStatement.objects.using(alias).filter(users_in_range, statement_date=statement_date).delete()
+        DailyStatement.objects.using(alias).bulk_create(statements, batch_size=1000)
+
+    # Written after the statements commit: a crash in between only means the range is redone.
+    EndOfDayCheckpoint.objects.using(PRIMARY_DATABASE).update_or_create(
+        statement_date=statement_date,
+        database=alias,
+        first_user_id=first_user_id,
+        defaults={'last_user_id': last_user_id, 'rows': len(statements)},
+    )
+    return len(statements)
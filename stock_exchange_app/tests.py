@@ -1,3 +1,962 @@
-from django.test import TestCase
+import json
+import tempfile
+from concurrent.futures import Future
+from datetime import date, timedelta
+from io import StringIO
+from pathlib import Path
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.management import CommandError, call_command
+from django.db import DatabaseError, transaction
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from stock_exchange import schema
+
+from . import ledger, pricefeed, risk, sharding, triggers, views
+from .admin import CHANGELIST_QUERY_BUDGET
+from .management.commands import end_of_day
+from .management.commands.feed_prices import parse_tick
+from .authentication import Generate_JWT_token
+from .models import (
+    Users, Stocks, Transaction, LedgerEntry, BalanceSnapshot, ConditionalOrder, RiskLimit, IdempotencyKey, IdNode,
+    DailyStatement, EndOfDayCheckpoint,
+)
+from .querybudget import QueryBudgetExceeded, QueryRecorder, assert_max_queries
+from .sharding import NODE_COUNT, PRIMARY_DATABASE, next_id, shard_databases, shard_for_username
+from .statements import build_statements, day_bounds
+from .trading import TradeRejected, execute_trade
+from .triggers import TriggerEngine, TriggerIndex
+
+TWO_SHARDS = ['default', 'shard_1']
+THREE_SHARDS = ['default', 'shard_1', 'shard_2']
+
+
+def username_off_primary():
+    """
+    A username homed off the primary when sharded, so lookups by pk fan out and a user's
+    rows commit separately from the primary's.
+    """
+    return next((name for name in ('alice', 'bob', 'carol', 'dave', 'erin')
+                 if shard_for_username(name) != PRIMARY_DATABASE), 'alice')
+
+
+class QueryBudgetTests(TestCase):
+    """
+    The list endpoints and the Transaction changelist run the same number of queries for 3 rows as for 40.
+    """
+
+    databases = '__all__'
+    ROW_COUNTS = (3, 40)
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = Users.objects.create(username='alice', balance=1000.0)
+        cls.stock = Stocks.objects.create(ticker='AAPL', stock_price=10.0, stock_name='Apple')
+
+    def add_transaction(self):
+        Transaction.objects.create(user=self.user, ticker=self.stock, transaction_type='BUY',
+                                   transaction_volume=1, transaction_price=10.0)
+
+    def add_conditional_order(self):
+        ConditionalOrder.objects.create(user=self.user, ticker=self.stock, order_type='STOP_LOSS',
+                                        transaction_type='SELL', transaction_volume=1, trigger_price=9.0)
+
+    def add_stock(self):
+        ticker = f'T{Stocks.objects.count()}'
+        Stocks.objects.create(ticker=ticker, stock_price=1.0, stock_name=ticker)
+
+    def assert_constant_queries(self, url, add_row, count_rows, max_queries, per_shard=0):
+        """
+        Grow the result to each of ROW_COUNTS rows and GET `url` within the same budget.
+        """
+        for rows in self.ROW_COUNTS:
+            while count_rows() < rows:
+                add_row()
+            with self.subTest(rows=rows), assert_max_queries(max_queries, per_shard=per_shard, label=url):
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(response.json()), rows)
+
+    def test_list_stocks(self):
+        self.assert_constant_queries('/stocks/', self.add_stock, Stocks.objects.count, 1)
+
+    def test_list_user_transactions(self):
+        self.assert_constant_queries(
+            '/transactions/alice/', self.add_transaction,
+            Transaction.objects.filter(user=self.user).count, 1, per_shard=1,
+        )
+
+    def test_list_transactions_by_timestamp(self):
+        start = (timezone.now() - timedelta(hours=1)).strftime('%Y-%m-%dT%H:%M:%SZ')
+        end = (timezone.now() + timedelta(hours=1)).strftime('%Y-%m-%dT%H:%M:%SZ')
+        self.assert_constant_queries(
+            f'/transactions/alice/{start}/{end}/', self.add_transaction,
+            Transaction.objects.filter(user=self.user).count, 1, per_shard=1,
+        )
+
+    def test_list_conditional_orders(self):
+        self.assert_constant_queries(
+            '/conditional_orders/alice/', self.add_conditional_order,
+            ConditionalOrder.objects.filter(user=self.user).count, 1, per_shard=1,
+        )
+
+    def test_transaction_admin_changelist(self):
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'password'))
+        url = reverse('admin:stock_exchange_app_transaction_changelist')
+        for rows in self.ROW_COUNTS:
+            while Transaction.objects.count() < rows:
+                self.add_transaction()
+            with self.subTest(rows=rows), assert_max_queries(CHANGELIST_QUERY_BUDGET, label=url):
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.context['cl'].result_count, rows)
+
+    def test_budget_exceeded(self):
+        with self.assertRaises(QueryBudgetExceeded):
+            with assert_max_queries(0):
+                list(Stocks.objects.all())
+
+    def test_transaction_control_is_not_counted(self):
+        # Under TestCase every atomic block is a savepoint.
+        with assert_max_queries(1):
+            with transaction.atomic():
+                list(Stocks.objects.all())
+
+    def test_lookup_on_each_shard_is_not_repeated(self):
+        with QueryRecorder() as recorder:
+            for alias in shard_databases():
+                Users.objects.using(alias).filter(pk=0).exists()
+        self.assertEqual(recorder.repeated(2), [])
+
+        with QueryRecorder() as recorder:
+            for _ in range(3):
+                Users.objects.using(PRIMARY_DATABASE).filter(pk=0).exists()
+        [(alias, _, count)] = recorder.repeated(3)
+        self.assertEqual((alias, count), (PRIMARY_DATABASE, 3))
+
+
+@override_settings(QUERY_BUDGET_ENFORCE=True)
+class WriteQueryBudgetTests(TestCase):
+    """
+    The write endpoints stay within their own budget and the query counts pinned here.
+    """
+
+    databases = '__all__'
+
+    def setUp(self):
+        for target, name, value in ((risk, '_engine', risk.RiskEngine()),
+                                    (pricefeed, '_buffer', pricefeed.PriceTickBuffer())):
+            patcher = mock.patch.object(target, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        caches[settings.IDEMPOTENCY_CACHE].clear()
+
+        admin = User.objects.create_user('admin', password='password')
+        self.client.defaults['HTTP_AUTHORIZATION'] = 'Bearer ' + Generate_JWT_token(admin)
+        self.user = Users.objects.create(username=username_off_primary(), balance=1000.0)
+        self.stock = Stocks.objects.create(ticker='AAPL', stock_price=10.0, stock_name='Apple')
+
+    def assert_post(self, url, data, max_queries, per_shard=0, expected_status=201, **extra):
+        with assert_max_queries(max_queries, per_shard=per_shard, label=url):
+            response = self.client.post(url, data, content_type='application/json', **extra)
+        self.assertEqual(response.status_code, expected_status, response.content)
+
+    def trade(self):
+        return {'user': self.user.pk, 'ticker': self.stock.pk, 'transaction_type': 'BUY',
+                'transaction_volume': 1, 'transaction_price': 0}
+
+    def test_register(self):
+        self.assert_post('/register/', {'username': 'bob', 'email': 'bob@example.com',
+                                        'password': 'secret', 'password1': 'secret'}, 3)
+
+    def test_login(self):
+        self.assert_post('/login/', {'username': 'admin', 'password': 'password'}, 1, expected_status=200)
+
+    def test_create_user(self):
+        self.assert_post('/users/', {'username': 'zed', 'balance': 50.0}, 5, per_shard=1)
+
+    def test_create_stock(self):
+        self.assert_post('/create_stock', {'ticker': 'MSFT', 'stock_price': 5.0, 'stock_name': 'Microsoft'},
+                         1, per_shard=2)
+
+    def test_create_transaction(self):
+        self.assert_post('/transactions/', self.trade(), 8, per_shard=1)
+
+    def test_create_transaction_with_idempotency_key(self):
+        self.assert_post('/transactions/', self.trade(), 11, per_shard=1, HTTP_IDEMPOTENCY_KEY='order-1')
+
+    def test_create_conditional_order(self):
+        self.assert_post('/conditional_orders/', {
+            'user': self.user.pk, 'ticker': self.stock.pk, 'order_type': 'STOP_LOSS',
+            'transaction_type': 'SELL', 'transaction_volume': 1, 'trigger_price': 9.0,
+        }, 3, per_shard=1)
+
+    def test_ingest_prices(self):
+        self.assert_post('/prices/', [{'ticker': 'AAPL', 'stock_price': 11.0}], 1, expected_status=202)
+
+
+@skipUnless(len(settings.DATABASES) >= 3, "Run with STOCK_EXCHANGE_SQLITE_SHARDS=3 to test sharding.")
+class ShardingTests(TestCase):
+    """
+    Routing of users and their rows over several databases, and moving them with rebalance_shards.
+    """
+
+    databases = '__all__'
+
+    def create_users(self, stock, count=30):
+        users = []
+        for index in range(count):
+            user = Users.objects.create(username=f'user{index}', balance=100.0)
+            ledger.credit(user, 100.0, LedgerEntry.FUNDING)
+            Transaction.objects.create(user=user, ticker=stock, transaction_type='BUY',
+                                       transaction_volume=1, transaction_price=10.0)
+            users.append(user)
+        return users
+
+    def assert_on_shard(self, user, alias):
+        """
+        The user and every row it owns are on `alias` and nowhere else.
+        """
+        for other in THREE_SHARDS:
+            expected = 1 if other == alias else 0
+            self.assertEqual(Users.objects.using(other).filter(pk=user.pk).count(), expected, other)
+            self.assertEqual(Transaction.objects.using(other).filter(user_id=user.pk).count(), expected, other)
+            self.assertEqual(LedgerEntry.objects.using(other).filter(user_id=user.pk).count(), expected, other)
+
+    @override_settings(SHARD_DATABASES=THREE_SHARDS)
+    def test_rows_follow_the_users_shard(self):
+        stock = Stocks.objects.create(ticker='AAPL', stock_price=10.0, stock_name='Apple')
+        for alias in THREE_SHARDS:
+            self.assertTrue(Stocks.objects.using(alias).filter(pk=stock.pk).exists(), alias)
+
+        users = self.create_users(stock)
+        self.assertEqual({user._state.db for user in users}, set(THREE_SHARDS))
+        for user in users:
+            alias = shard_for_username(user.username)
+            self.assertEqual(user._state.db, alias)
+            self.assert_on_shard(user, alias)
+            self.assertEqual(Users.objects.get(username=user.username)._state.db, alias)
+            self.assertEqual(Users.objects.get(pk=user.pk)._state.db, alias)
+            self.assertEqual(Transaction.objects.filter(user__username=user.username).count(), 1)
+
+    def test_rebalance_moves_users_to_an_added_shard(self):
+        with override_settings(SHARD_DATABASES=TWO_SHARDS):
+            stock = Stocks.objects.create(ticker='AAPL', stock_price=10.0, stock_name='Apple')
+            users = self.create_users(stock)
+            before = {user.pk: shard_for_username(user.username) for user in users}
+
+        with override_settings(SHARD_DATABASES=THREE_SHARDS):
+            call_command('rebalance_shards', batch_size=7, stdout=StringIO())
+            self.assertTrue(Stocks.objects.using('shard_2').filter(pk=stock.pk).exists())
+
+            moved = 0
+            for user in users:
+                alias = shard_for_username(user.username)
+                self.assert_on_shard(user, alias)
+                if alias != before[user.pk]:
+                    # Consistent hashing only moves users to the added shard.
+                    self.assertEqual(alias, 'shard_2')
+                    moved += 1
+                self.assertEqual(ledger.balance_at(Users.objects.get(username=user.username)), 100.0)
+            self.assertGreater(moved, 0)
+            self.assertLess(moved, len(users))
+
+    def test_existing_username_is_rejected_before_the_rebalance(self):
+        with override_settings(SHARD_DATABASES=TWO_SHARDS):
+            stock = Stocks.objects.create(ticker='AAPL', stock_price=10.0, stock_name='Apple')
+            users = self.create_users(stock)
+
+        admin = User.objects.create_user('admin', password='password')
+        self.client.defaults['HTTP_AUTHORIZATION'] = 'Bearer ' + Generate_JWT_token(admin)
+        with override_settings(SHARD_DATABASES=THREE_SHARDS):
+            # Homed on the added shard but still on its old one until the rebalance runs.
+            user = next(user for user in users if shard_for_username(user.username) == 'shard_2')
+            response = self.client.post('/users/', {'username': user.username, 'balance': 50.0})
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('username already exists', response.json()['error'])
+            self.assertEqual(sum(Users.objects.using(alias).filter(username=user.username).count()
+                                 for alias in THREE_SHARDS), 1)
+            self.assertEqual(self.client.get(f'/users/{user.username}/').json()['balance'], 100.0)
+
+            call_command('rebalance_shards', stdout=StringIO())
+            self.assert_on_shard(user, 'shard_2')
+
+
+class NodeIdTests(TestCase):
+    """
+    Node bits of sharded ids come from SHARD_NODE_ID or an IdNode row claimed per process.
+    """
+
+    databases = '__all__'
+
+    def setUp(self):
+        patcher = mock.patch.dict(sharding._id_state, pid=None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    @staticmethod
+    def node_of(id_value):
+        return (id_value >> 12) & (NODE_COUNT - 1)
+
+    @override_settings(SHARD_NODE_ID=7)
+    def test_configured_node_id(self):
+        self.assertEqual(self.node_of(next_id()), 7)
+        self.assertFalse(IdNode.objects.exists())
+
+    @override_settings(SHARD_NODE_ID=None)
+    def test_claimed_node_id(self):
+        first = next_id()
+        node = IdNode.objects.get()
+        self.assertEqual(self.node_of(first), 1 + (node.pk - 1) % (NODE_COUNT - 1))
+
+        # Later ids of the same process keep the node; a new process claims another one.
+        self.assertEqual(self.node_of(next_id()), self.node_of(first))
+        sharding._id_state['pid'] = None
+        self.assertNotEqual(self.node_of(next_id()), self.node_of(first))
+        self.assertEqual(IdNode.objects.count(), 2)
+
+
+class SchemaTests(SimpleTestCase):
+    """
+    The prebuilt OpenAPI schema file, its staleness checks and the on-demand fallback.
+    """
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = Path(directory.name) / 'openapi.json'
+        override = override_settings(OPENAPI_SCHEMA_FILE=self.path)
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def test_schema_covers_every_endpoint(self):
+        paths = json.loads(schema.generate_schema())['paths']
+        for path in ('/prices/', '/prices/metrics/', '/conditional_orders/',
+                     '/conditional_orders/{username}/', '/users/{username}/balance/{timestamp}/'):
+            self.assertIn(path, paths)
+        headers = [param['name'] for param in paths['/transactions/']['post']['parameters'] if param['in'] == 'header']
+        self.assertEqual(headers, ['Idempotency-Key'])
+
+    def test_check_fails_on_a_missing_or_stale_file(self):
+        with self.assertRaisesMessage(CommandError, 'does not exist'):
+            call_command('generate_schema', check=True, stdout=StringIO())
+        self.assertEqual([warning.id for warning in schema.check_prebuilt_schema()], ['stock_exchange.W001'])
+
+        self.path.write_bytes(b'{"paths": {}}')
+        with self.assertRaisesMessage(CommandError, 'out of date'):
+            call_command('generate_schema', check=True, stdout=StringIO())
+        self.assertEqual([warning.id for warning in schema.check_prebuilt_schema()], ['stock_exchange.W002'])
+
+        call_command('generate_schema', stdout=StringIO())
+        call_command('generate_schema', check=True, stdout=StringIO())
+        self.assertEqual(schema.check_prebuilt_schema(), [])
+
+    def test_prebuilt_file_is_served(self):
+        call_command('generate_schema', stdout=StringIO())
+        for url in ('/openapi.json', '/swagger/?format=openapi', '/redoc/?format=openapi'):
+            with self.subTest(url=url):
+                response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response.content, self.path.read_bytes())
+
+    def test_missing_file_falls_back_to_generation(self):
+        for url in ('/openapi.json', '/swagger/?format=openapi'):
+            with self.subTest(url=url):
+                response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+                self.assertTrue(response['Content-Type'].startswith('application/json'))
+                self.assertIn('/prices/', json.loads(response.content)['paths'])
+
+
+class TriggerIndexTests(SimpleTestCase):
+    """
+    Crossed orders are popped from the per-ticker heaps; discarded ones are skipped lazily.
+    """
+
+    def setUp(self):
+        self.index = TriggerIndex()
+        self.index.add(1, 'AAPL', ConditionalOrder.ABOVE, 110.0, 'take profit')
+        self.index.add(2, 'AAPL', ConditionalOrder.ABOVE, 120.0, 'breakout')
+        self.index.add(3, 'AAPL', ConditionalOrder.BELOW, 90.0, 'stop loss')
+        self.index.add(4, 'AAPL', ConditionalOrder.BELOW, 80.0, 'deep stop')
+        self.index.add(5, 'MSFT', ConditionalOrder.ABOVE, 50.0, 'other ticker')
+
+    def test_price_between_triggers_fires_nothing(self):
+        self.assertEqual(self.index.crossed('AAPL', 100.0), [])
+        self.assertEqual(len(self.index), 5)
+
+    def test_above_fires_at_or_over_the_trigger(self):
+        self.assertEqual(self.index.crossed('AAPL', 110.0), [(1, 'take profit')])
+        self.assertEqual(sorted(self.index.crossed('AAPL', 200.0)), [(2, 'breakout')])
+        self.assertNotIn(1, self.index)
+        self.assertIn(5, self.index)
+
+    def test_below_fires_at_or_under_the_trigger(self):
+        self.assertEqual(self.index.crossed('AAPL', 90.0), [(3, 'stop loss')])
+        self.assertEqual(self.index.crossed('AAPL', 10.0), [(4, 'deep stop')])
+        self.assertEqual(len(self.index), 3)
+
+    def test_fired_orders_are_removed(self):
+        self.assertEqual(len(self.index.crossed('AAPL', 500.0)), 2)
+        self.assertEqual(self.index.crossed('AAPL', 500.0), [])
+
+    def test_discarded_orders_are_skipped(self):
+        self.index.discard(1)
+        self.index.discard(4)
+        self.assertNotIn(1, self.index)
+        self.assertEqual(self.index.crossed('AAPL', 115.0), [])
+        self.assertEqual(self.index.crossed('AAPL', 0.0), [(3, 'stop loss')])
+        # The discarded entries were dropped from the heaps on the way.
+        self.assertEqual(self.index._above['AAPL'], [(120.0, 2)])
+        self.assertEqual(self.index._below['AAPL'], [])
+
+    def test_unknown_ticker(self):
+        self.assertEqual(self.index.crossed('GOOG', 1.0), [])
+
+
+class TradingTests(TestCase):
+    """
+    execute_trade and the trigger engine against the database.
+    """
+
+    databases = '__all__'
+
+    def setUp(self):
+        # An empty engine without its sync thread; limits default to unlimited.
+        self.engine = risk.RiskEngine()
+        patcher = mock.patch.object(risk, '_engine', self.engine)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.user = Users.objects.create(username='alice', balance=1000.0)
+        ledger.credit(self.user, 1000.0, LedgerEntry.FUNDING)
+        self.stock = Stocks.objects.create(ticker='AAPL', stock_price=100.0, stock_name='Apple')
+
+    def test_non_positive_volume_is_rejected(self):
+        self.engine.set_limits(self.user.pk, [None, None, None, 10.0])
+        for volume in (-100, 0):
+            with self.subTest(volume=volume), self.assertRaises(TradeRejected):
+                execute_trade(self.user, self.stock, 'SELL', volume)
+        self.assertEqual(self.engine._daily_volume[self.user.pk], 0.0)
+
+        # The daily cap still holds: a negative trade did not make room under it.
+        with self.captureOnCommitCallbacks(execute=True):
+            execute_trade(self.user, self.stock, 'BUY', 6)
+        with self.assertRaisesMessage(TradeRejected, "Daily volume 12 would exceed the limit of 10"):
+            execute_trade(self.user, self.stock, 'BUY', 6)
+        self.assertEqual(Transaction.objects.filter(user=self.user).count(), 1)
+
+    def test_trade_with_a_stale_user_uses_the_current_balance(self):
+        first = Users.objects.get(pk=self.user.pk)
+        second = Users.objects.get(pk=self.user.pk)
+        execute_trade(first, self.stock, 'BUY', 1)
+        execute_trade(second, self.stock, 'BUY', 1)
+
+        self.assertEqual(second.balance, 800.0)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.balance, 800.0)
+        self.assertEqual(ledger.balance_at(self.user), 800.0)
+
+    def test_failed_conditional_order_is_indexed_again(self):
+        order = ConditionalOrder.objects.create(user=self.user, ticker=self.stock, order_type='STOP_LOSS',
+                                                transaction_type='SELL', transaction_volume=1, trigger_price=90.0)
+        engine = TriggerEngine()
+        engine.refresh(force=True)
+
+        with mock.patch.object(triggers, 'execute_trade', side_effect=RuntimeError("database went away")), \
+                self.assertLogs(triggers.logger, 'ERROR'):
+            engine.on_prices({'AAPL': 85.0})
+        order.refresh_from_db()
+        self.assertEqual(order.status, ConditionalOrder.PENDING)
+        self.assertIn(order.pk, engine.index)
+
+        engine.on_prices({'AAPL': 85.0})
+        order.refresh_from_db()
+        self.assertEqual(order.status, ConditionalOrder.FILLED)
+        self.assertNotIn(order.pk, engine.index)
+        self.assertEqual(order.transaction.transaction_type, 'SELL')
+
+
+@override_settings(PRICE_FLUSH_LISTENERS=[])
+class PriceFeedTests(TestCase):
+    """
+    The coalescing tick buffer, its bulk flush to every database, POST /prices/ and feed_prices.
+    """
+
+    databases = '__all__'
+
+    def setUp(self):
+        for ticker, price in (('AAPL', 10.0), ('MSFT', 20.0), ('GOOG', 30.0)):
+            Stocks.objects.create(ticker=ticker, stock_price=price, stock_name=ticker)
+
+    def assert_prices(self, expected):
+        for alias in shard_databases():
+            prices = dict(Stocks.objects.using(alias).values_list('ticker', 'stock_price'))
+            self.assertEqual(prices, expected, alias)
+
+    def test_last_write_wins(self):
+        price_buffer = pricefeed.PriceTickBuffer()
+        self.assertEqual(price_buffer.submit('AAPL', 11), pricefeed.ACCEPTED)
+        self.assertEqual(price_buffer.submit('AAPL', 12.5), pricefeed.MERGED)
+        self.assertEqual(price_buffer.submit('MSFT', 21), pricefeed.ACCEPTED)
+        self.assertEqual(price_buffer.submit('NOPE', 1), pricefeed.ACCEPTED)
+
+        self.assertEqual(price_buffer.flush(), 2)
+        self.assert_prices({'AAPL': 12.5, 'MSFT': 21.0, 'GOOG': 30.0})
+        metrics = price_buffer.metrics()
+        self.assertEqual((metrics['received'], metrics['merged'], metrics['dropped']), (4, 1, 0))
+        self.assertEqual((metrics['flushes'], metrics['flushed_tickers'], metrics['unknown_tickers']), (1, 2, 1))
+        self.assertEqual(metrics['pending'], 0)
+        self.assertEqual(price_buffer.flush(), 0)
+
+    def test_invalid_and_excess_ticks_are_dropped(self):
+        price_buffer = pricefeed.PriceTickBuffer(max_pending=2)
+        for ticker, price in ((None, 1.0), ('', 1.0), ('AAPL', None), ('AAPL', '11'), ('AAPL', True),
+                              ('AAPL', 0), ('AAPL', -1.0), ('AAPL', float('nan')), ('AAPL', float('inf'))):
+            with self.subTest(ticker=ticker, price=price):
+                self.assertEqual(price_buffer.submit(ticker, price), pricefeed.DROPPED)
+
+        self.assertEqual(price_buffer.submit('AAPL', 11), pricefeed.ACCEPTED)
+        self.assertEqual(price_buffer.submit('MSFT', 21), pricefeed.ACCEPTED)
+        # Full: a new ticker is dropped, a pending one can still be updated.
+        self.assertEqual(price_buffer.submit('GOOG', 31), pricefeed.DROPPED)
+        self.assertEqual(price_buffer.submit('AAPL', 12), pricefeed.MERGED)
+
+        metrics = price_buffer.metrics()
+        self.assertEqual((metrics['received'], metrics['merged'], metrics['dropped'], metrics['pending']),
+                         (13, 1, 10, 2))
+        price_buffer.flush()
+        self.assert_prices({'AAPL': 12.0, 'MSFT': 21.0, 'GOOG': 30.0})
+
+    def test_failed_flush_puts_the_batch_back(self):
+        price_buffer = pricefeed.PriceTickBuffer()
+        price_buffer.submit('AAPL', 11)
+        price_buffer.submit('MSFT', 21)
+
+        def tick_then_fail(prices):
+            # A newer tick arrives while the batch is being written.
+            price_buffer.submit('AAPL', 12)
+            raise DatabaseError("connection lost")
+
+        with mock.patch.object(pricefeed, 'bulk_update_prices', side_effect=tick_then_fail):
+            with self.assertRaises(DatabaseError):
+                price_buffer.flush()
+        metrics = price_buffer.metrics()
+        self.assertEqual((metrics['flush_errors'], metrics['flushes'], metrics['pending']), (1, 0, 2))
+        self.assertIsNotNone(metrics['oldest_pending_age_ms'])
+        self.assert_prices({'AAPL': 10.0, 'MSFT': 20.0, 'GOOG': 30.0})
+
+        self.assertEqual(price_buffer.flush(), 2)
+        self.assert_prices({'AAPL': 12.0, 'MSFT': 21.0, 'GOOG': 30.0})
+
+    def test_bulk_update_prices_updates_every_database(self):
+        with mock.patch.object(pricefeed, 'UPDATE_CHUNK_SIZE', 2):
+            updated = pricefeed.bulk_update_prices({'AAPL': 1.5, 'MSFT': 2.5, 'GOOG': 3.5, 'NOPE': 4.5})
+        self.assertEqual(updated, 3)
+        self.assert_prices({'AAPL': 1.5, 'MSFT': 2.5, 'GOOG': 3.5})
+
+    def test_ingest_prices_endpoint(self):
+        admin = User.objects.create_user('admin', password='password')
+        self.client.defaults['HTTP_AUTHORIZATION'] = 'Bearer ' + Generate_JWT_token(admin)
+        price_buffer = pricefeed.PriceTickBuffer()
+        with mock.patch.object(pricefeed, '_buffer', price_buffer):
+            response = self.client.post('/prices/', [
+                {'ticker': 'AAPL', 'stock_price': 11.0},
+                {'ticker': 'AAPL', 'stock_price': 12.0},
+                {'ticker': 'MSFT', 'stock_price': 21.0},
+                {'ticker': 'GOOG', 'stock_price': -1.0},
+                'GOOG 31',
+            ], content_type='application/json')
+            self.assertEqual(response.status_code, 202)
+            self.assertEqual(response.json(), {'accepted': 2, 'merged': 1, 'dropped': 2})
+
+            response = self.client.post('/prices/', {'ticker': 'AAPL', 'stock_price': 11.0},
+                                        content_type='application/json')
+            self.assertEqual(response.status_code, 400)
+
+        # Buffered only; written on the next flush.
+        self.assert_prices({'AAPL': 10.0, 'MSFT': 20.0, 'GOOG': 30.0})
+        price_buffer.flush()
+        self.assert_prices({'AAPL': 12.0, 'MSFT': 21.0, 'GOOG': 30.0})
+
+    def test_parse_tick(self):
+        for line, expected in (('AAPL 11.5\n', ('AAPL', 11.5)), ('AAPL,11.5', ('AAPL', 11.5)),
+                               ('  MSFT\t21 ', ('MSFT', 21.0)), ('AAPL', (None, None)),
+                               ('AAPL eleven', (None, None)), ('AAPL 1 2', (None, None)), ('', (None, None))):
+            with self.subTest(line=line):
+                self.assertEqual(parse_tick(line), expected)
+
+    def test_feed_prices_from_stdin(self):
+        stdout = StringIO()
+        with mock.patch('sys.stdin', StringIO("AAPL 11\nAAPL,12\nMSFT 21\nnot a tick\n")), \
+                mock.patch('signal.signal'):
+            call_command('feed_prices', interval=60, stdout=stdout)
+        self.assertIn("Received 4 ticks: 1 merged, 1 dropped, 2 prices written in 1 flushes", stdout.getvalue())
+        self.assert_prices({'AAPL': 12.0, 'MSFT': 21.0, 'GOOG': 30.0})
+
+
+@override_settings(LEDGER_SNAPSHOT_INTERVAL=3)
+class LedgerTests(TestCase):
+    """
+    Balance-at-time lookups before, at and after a BalanceSnapshot.
+    """
+
+    databases = '__all__'
+
+    def setUp(self):
+        self.user = Users.objects.create(username='alice', balance=0.0)
+        self.start = timezone.now() - timedelta(days=1)
+        # Entries one hour apart; the third one triggers a snapshot.
+        self.amounts = [100.0, -30.0, 50.0, -20.0, 5.0]
+        for hour, amount in enumerate(self.amounts, start=1):
+            with mock.patch('django.utils.timezone.now', return_value=self.at(hour)):
+                if amount > 0:
+                    ledger.credit(self.user, amount, LedgerEntry.FUNDING)
+                else:
+                    ledger.debit(self.user, -amount, 'BUY')
+
+    def at(self, hour):
+        return self.start + timedelta(hours=hour)
+
+    def test_snapshot_is_taken_at_the_interval(self):
+        snapshot = BalanceSnapshot.objects.get(user=self.user)
+        self.assertEqual(snapshot.balance, 120.0)
+        self.assertEqual(snapshot.as_of, self.at(3))
+
+    def test_balance_at(self):
+        self.assertEqual(ledger.balance_at(self.user, self.start), 0.0)
+        for hour in range(1, len(self.amounts) + 1):
+            with self.subTest(hour=hour):
+                self.assertEqual(ledger.balance_at(self.user, self.at(hour)), sum(self.amounts[:hour]))
+        self.assertEqual(ledger.balance_at(self.user), sum(self.amounts))
+
+    def test_lookups_after_the_snapshot_start_from_it(self):
+        BalanceSnapshot.objects.filter(user=self.user).update(balance=1000.0)
+        # Before the snapshot the entries are summed from the start ...
+        self.assertEqual(ledger.balance_at(self.user, self.at(2)), 70.0)
+        # ... from it on, only the entries after the snapshot are added to its balance.
+        self.assertEqual(ledger.balance_at(self.user, self.at(3)), 1000.0)
+        self.assertEqual(ledger.balance_at(self.user, self.at(4)), 980.0)
+        self.assertEqual(ledger.balance_at(self.user), 985.0)
+
+    def test_balance_endpoint(self):
+        timestamp = self.at(4).strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+        response = self.client.get(f'/users/alice/balance/{timestamp}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['balance'], 100.0)
+
+
+class InlineExecutor:
+    """
+    Stands in for end_of_day's ProcessPoolExecutor: runs each task in the test's own transaction.
+    """
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def submit(self, fn, *args):
+        future = Future()
+        try:
+            future.set_result(fn(*args))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+
+class StatementTests(TestCase):
+    """
+    End-of-day statements from build_statements, and end_of_day's checkpoints.
+    """
+
+    databases = '__all__'
+    STATEMENT_DATE = date(2026, 1, 15)
+
+    def setUp(self):
+        self.day_start, self.day_end = day_bounds(self.STATEMENT_DATE)
+        self.aapl = Stocks.objects.create(ticker='AAPL', stock_price=10.0, stock_name='Apple')
+        self.msft = Stocks.objects.create(ticker='MSFT', stock_price=50.0, stock_name='Microsoft')
+        self.alice = Users.objects.create(username='alice', balance=1000.0)
+        self.bob = Users.objects.create(username='bob', balance=500.0)
+
+        hour = timedelta(hours=1)
+        for at, stock, transaction_type, volume, price in (
+            (self.day_start - hour, self.aapl, 'BUY', 7, 70.0),
+            (self.day_start + hour, self.aapl, 'BUY', 2, 20.0),
+            (self.day_start + 2 * hour, self.aapl, 'SELL', 3, 30.0),
+            (self.day_start + 3 * hour, self.msft, 'BUY', 1, 50.0),
+            (self.day_end, self.msft, 'BUY', 9, 450.0),
+        ):
+            with mock.patch('django.utils.timezone.now', return_value=at):
+                Transaction.objects.create(user=self.alice, ticker=stock, transaction_type=transaction_type,
+                                           transaction_volume=volume, transaction_price=price)
+
+        # Only entries from the end of the day on are taken back out of the current balance.
+        for at, user, amount in ((self.day_end - hour, self.alice, -40.0), (self.day_end, self.alice, 200.0),
+                                 (self.day_end + hour, self.alice, -50.0), (self.day_end + hour, self.bob, -100.0)):
+            with mock.patch('django.utils.timezone.now', return_value=at):
+                if amount > 0:
+                    ledger.credit(user, amount, LedgerEntry.FUNDING)
+                else:
+                    ledger.debit(user, -amount, 'BUY')
+
+    def build_all(self):
+        return sum(
+            build_statements(alias, self.STATEMENT_DATE, first_user_id, last_user_id)
+            for alias in shard_databases()
+            for first_user_id, last_user_id in sharding.user_id_ranges(alias, 1000)
+        )
+
+    def statements(self):
+        return {
+            (row.user_id, row.ticker_id): (row.trade_count, row.volume, row.notional, row.closing_balance)
+            for alias in shard_databases()
+            for row in DailyStatement.objects.using(alias).filter(statement_date=self.STATEMENT_DATE)
+        }
+
+    def end_of_day(self, *args, **options):
+        stdout = StringIO()
+        with mock.patch.object(end_of_day, 'ProcessPoolExecutor', InlineExecutor), \
+                mock.patch.object(end_of_day, 'connections'):
+            call_command('end_of_day', *args, date=self.STATEMENT_DATE, workers=1, stdout=stdout, **options)
+        return stdout.getvalue()
+
+    def test_statements(self):
+        expected = {
+            (self.alice.pk, self.aapl.pk): (2, 5.0, 50.0, 850.0),
+            (self.alice.pk, self.msft.pk): (1, 1.0, 50.0, 850.0),
+            (self.bob.pk, None): (0, 0.0, 0.0, 600.0),
+        }
+        self.assertEqual(self.build_all(), 3)
+        self.assertEqual(self.statements(), expected)
+        # Re-running a range replaces its rows.
+        self.assertEqual(self.build_all(), 3)
+        self.assertEqual(self.statements(), expected)
+
+    def test_statements_are_stored_on_the_users_shard(self):
+        self.build_all()
+        for user in (self.alice, self.bob):
+            self.assertTrue(DailyStatement.objects.using(user._state.db).filter(user_id=user.pk).exists())
+
+    def test_end_of_day_skips_checkpointed_ranges(self):
+        ranges = sum(len(sharding.user_id_ranges(alias, 1)) for alias in shard_databases())
+        self.assertIn(f"{ranges} user ranges to process, 0 already done", self.end_of_day(range_size=1))
+        self.assertEqual(EndOfDayCheckpoint.objects.filter(statement_date=self.STATEMENT_DATE).count(), ranges)
+        expected = self.statements()
+        self.assertEqual(len(expected), 3)
+
+        # Checkpointed ranges are not rebuilt, even though a statement row went missing.
+        DailyStatement.objects.using(self.bob._state.db).filter(user_id=self.bob.pk).delete()
+        self.assertIn(f"0 user ranges to process, {ranges} already done", self.end_of_day(range_size=1))
+        self.assertNotIn((self.bob.pk, None), self.statements())
+
+        self.assertIn(f"{ranges} user ranges to process, 0 already done",
+                      self.end_of_day('--restart', range_size=1))
+        self.assertEqual(self.statements(), expected)
+
+    def test_end_of_day_redoes_a_range_that_grew(self):
+        self.end_of_day(range_size=1000)
+        alias = self.alice._state.db
+        first_user_id, _ = sharding.user_id_ranges(alias, 1000)[0]
+
+        # A user added after the run on alice's database extends that database's last range.
+        username = next(f'user{index}' for index in range(1000) if shard_for_username(f'user{index}') == alias)
+        carol = Users.objects.create(username=username, balance=10.0)
+        self.assertEqual(sharding.user_id_ranges(alias, 1000), [(first_user_id, carol.pk)])
+
+        self.assertIn("1 user ranges to process", self.end_of_day(range_size=1000))
+        self.assertEqual(self.statements()[(carol.pk, None)], (0, 0.0, 0.0, 10.0))
+        checkpoint = EndOfDayCheckpoint.objects.get(statement_date=self.STATEMENT_DATE, database=alias,
+                                                    first_user_id=first_user_id)
+        self.assertEqual(checkpoint.last_user_id, carol.pk)
+
+
+class IdempotencyKeyTests(TestCase):
+    """
+    POST /transactions/ with an Idempotency-Key header trades at most once per key.
+    """
+
+    databases = '__all__'
+
+    def setUp(self):
+        patcher = mock.patch.object(risk, '_engine', risk.RiskEngine())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        caches[settings.IDEMPOTENCY_CACHE].clear()
+
+        admin = User.objects.create_user('trader', password='password')
+        self.client.defaults['HTTP_AUTHORIZATION'] = 'Bearer ' + Generate_JWT_token(admin)
+        # When sharded, a user off the primary, so the key's claim and the trade commit separately.
+        self.user = Users.objects.create(username=username_off_primary(), balance=1000.0)
+        self.stock = Stocks.objects.create(ticker='AAPL', stock_price=100.0, stock_name='Apple')
+
+    def buy(self, key, volume=1):
+        return self.client.post('/transactions/', {
+            'user': self.user.pk,
+            'ticker': self.stock.pk,
+            'transaction_type': 'BUY',
+            'transaction_volume': volume,
+            'transaction_price': 0,
+        }, HTTP_IDEMPOTENCY_KEY=key)
+
+    def trade_count(self):
+        return sum(Transaction.objects.using(alias).count() for alias in shard_databases())
+
+    def test_retry_replays_the_first_response(self):
+        first = self.buy('order-1')
+        self.assertEqual(first.status_code, 201)
+        self.assertNotIn('Idempotent-Replayed', first)
+
+        retry = self.buy('order-1')
+        self.assertEqual(retry.status_code, 201)
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(retry.json(), first.json())
+        self.assertEqual(self.trade_count(), 1)
+        self.assertEqual(Users.objects.get(pk=self.user.pk).balance, 900.0)
+
+        self.assertEqual(self.buy('order-2').status_code, 201)
+        self.assertEqual(self.trade_count(), 2)
+
+    def test_replay_from_the_cache(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            first = self.buy('order-1')
+        # Only the JWT user lookup: the stored response comes from the cache.
+        with assert_max_queries(1):
+            retry = self.buy('order-1')
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(retry.json(), first.json())
+
+    def test_rejected_trade_is_replayed(self):
+        first = self.buy('order-1', volume=20)
+        self.assertEqual(first.status_code, 400)
+        self.user.balance = 5000.0
+        self.user.save()
+
+        retry = self.buy('order-1', volume=20)
+        self.assertEqual(retry.status_code, 400)
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(self.trade_count(), 0)
+
+    def test_key_reused_for_a_different_body(self):
+        self.assertEqual(self.buy('order-1').status_code, 201)
+        response = self.buy('order-1', volume=2)
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(self.trade_count(), 1)
+
+    def test_server_error_is_not_stored(self):
+        with mock.patch.object(views, 'execute_trade', side_effect=RuntimeError("database went away")):
+            self.assertEqual(self.buy('order-1').status_code, 500)
+        self.assertFalse(IdempotencyKey.objects.exists())
+        self.assertEqual(self.trade_count(), 0)
+
+        retry = self.buy('order-1')
+        self.assertEqual(retry.status_code, 201)
+        self.assertNotIn('Idempotent-Replayed', retry)
+        self.assertEqual(self.trade_count(), 1)
+
+    def test_server_error_after_the_trade_does_not_trade_twice(self):
+        real_execute_trade = views.execute_trade
+
+        def trade_then_fail(*args, **kwargs):
+            real_execute_trade(*args, **kwargs)
+            raise RuntimeError("connection reset")
+
+        with mock.patch.object(views, 'execute_trade', side_effect=trade_then_fail):
+            self.assertEqual(self.buy('order-1').status_code, 500)
+
+        self.assertEqual(self.buy('order-1').status_code, 201)
+        self.assertEqual(self.buy('order-1')['Idempotent-Replayed'], 'true')
+        self.assertEqual(self.trade_count(), 1)
+        self.assertEqual(Users.objects.get(pk=self.user.pk).balance, 900.0)
+
+    def test_lost_claim_and_a_different_body(self):
+        self.assertEqual(self.buy('order-1').status_code, 201)
+        # The claim is gone (rolled back on the primary), but the trade on the shard holds the key.
+        IdempotencyKey.objects.all().delete()
+        caches[settings.IDEMPOTENCY_CACHE].clear()
+
+        response = self.buy('order-1', volume=2)
+        self.assertEqual(response.status_code, 422)
+        self.assertIn('different request', response.json()['error'])
+        self.assertEqual(self.trade_count(), 1)
+        self.assertEqual(Users.objects.get(pk=self.user.pk).balance, 900.0)
+
+    def test_invalid_key(self):
+        self.assertEqual(self.buy('').status_code, 400)
+        self.assertEqual(self.buy('x' * 256).status_code, 400)
+        self.assertEqual(self.trade_count(), 0)
+
+
+class RiskEngineTests(TestCase):
+    """
+    Reservations of in-flight trades and the incremental sync of RiskLimit rows.
+    """
+
+    databases = '__all__'
+
+    def setUp(self):
+        self.engine = risk.RiskEngine(default=risk.RiskLimits(1e9, 1000.0, 1500.0, 1e9))
+        self.engine.load()
+
+    def test_reservations_count_against_the_limits(self):
+        reason, first = self.engine.reserve(1, 1, 'BUY', 1, 600.0)
+        self.assertIsNone(reason)
+        reason, second = self.engine.reserve(1, 1, 'BUY', 1, 600.0)
+        self.assertIn("Exposure to this stock 1200.00", reason)
+        self.assertIsNone(second)
+        # Trades that reduce the exposure still pass.
+        self.assertIsNone(self.engine.check(1, 1, 'SELL', 1, 600.0))
+
+        self.engine.release(first)
+        self.assertIsNone(self.engine.check(1, 1, 'BUY', 1, 600.0))
+
+    def test_non_positive_amounts_are_rejected(self):
+        for volume, notional in ((-100, 600.0), (0, 600.0), (1, -600.0), (1, 0.0)):
+            with self.subTest(volume=volume, notional=notional):
+                reason, token = self.engine.reserve(1, 1, 'SELL', volume, notional)
+                self.assertEqual(reason, "Volume and notional must be positive")
+                self.assertIsNone(token)
+        self.assertFalse(self.engine._reservations)
+        self.assertEqual(self.engine._reserved_volume[1], 0.0)
+
+    def test_recorded_trade_replaces_its_reservation(self):
+        user = Users.objects.create(username='alice', balance=10000.0)
+        stock = Stocks.objects.create(ticker='AAPL', stock_price=100.0, stock_name='Apple')
+        _, token = self.engine.reserve(user.pk, stock.pk, 'BUY', 6, 600.0)
+        trade = Transaction.objects.create(user=user, ticker=stock, transaction_type='BUY',
+                                           transaction_volume=6, transaction_price=600.0)
+        self.engine.record(trade, token)
+        self.engine.record(trade, token)
+
+        self.assertEqual(self.engine._exposure[user.pk], 600.0)
+        self.assertEqual(self.engine._reserved_notional[user.pk], 0.0)
+        self.assertIn("Exposure to this stock 1200.00", self.engine.check(user.pk, stock.pk, 'BUY', 6, 600.0))
+
+    def test_sync_applies_changed_and_deleted_limits(self):
+        user = Users.objects.create(username='alice', balance=10000.0)
+        limit = RiskLimit.objects.create(user=user, max_order_notional=100.0)
+        self.engine.sync()
+        self.assertIn("exceeds the limit of 100.00", self.engine.check(user.pk, 1, 'BUY', 1, 200.0))
+
+        limit.max_order_notional = 500.0
+        limit.save()
+        self.engine.sync()
+        self.assertIsNone(self.engine.check(user.pk, 1, 'BUY', 1, 200.0))
+
+        # Unchanged rows are not read again.
+        with assert_max_queries(0, per_shard=3):
+            self.engine.sync()
+
+        RiskLimit.objects.filter(user=user).delete()
+        self.engine.sync()
+        self.assertNotIn(user.pk, self.engine._limits)
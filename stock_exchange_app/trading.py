@@ -0,0 +1,95 @@
+"""
+Trade execution shared by CreateTransactionView and triggered conditional orders.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from . import ledger, risk
+from .idempotency import HEADER as IDEMPOTENCY_HEADER
+from .models import Transaction, Users
+
+
+class TradeRejected(Exception):
+    """
+    Raised when a trade fails validation, e.g. insufficient balance for a buy or a risk limit.
+    """
+
+
+class IdempotencyKeyReused(Exception):
+    """
+    Raised when the idempotency key already recorded a trade for a different request.
+    """
+
+
+def execute_trade(user, stock, transaction_type, volume, idempotency_key=None):
+    """
+    Price the trade at the current stock price, update the user's balance and record
+    the Transaction and its ledger entry in one database transaction.
+
+    With an `idempotency_key` the key is stored on the Transaction, and a trade recorded
+    under that key within IDEMPOTENCY_KEY_TTL is returned instead of trading again.
+    :return: The created (or previously recorded) Transaction.
+    :raises: TradeRejected if the volume or price is not positive, the user cannot afford
+             a buy or the trade breaches a risk limit.
+    :raises: IdempotencyKeyReused if the trade recorded under the key differs in user,
+             ticker, type or volume.
+    """
+    if not volume > 0:
+        raise TradeRejected("Transaction volume must be positive")
+
+    if idempotency_key is not None:
+        existing = Transaction.objects.using(user._state.db).filter(
+            idempotency_key=idempotency_key,
+            created_time__gte=timezone.now() - timedelta(seconds=settings.IDEMPOTENCY_KEY_TTL),
+        ).first()
+        if existing is not None:
+            if (existing.user_id, existing.ticker_id, existing.transaction_type, existing.transaction_volume) \
+                    != (user.pk, stock.pk, transaction_type, volume):
+                raise IdempotencyKeyReused(f"{IDEMPOTENCY_HEADER} was already used for a different request.")
+            return existing
+
+    price = stock.stock_price * volume
+    if not price > 0:
+        raise TradeRejected("Stock price must be positive")
+
+    risk_engine = risk.get_engine()
+    reason, reservation = risk_engine.reserve(user.pk, stock.pk, transaction_type, volume, price)
+    if reason:
+        raise TradeRejected(reason)
+
+    alias = user._state.db
+    try:
+        with transaction.atomic(using=alias):
+            # Re-read the balance under a row lock so concurrent trades for the user serialize here.
+            locked = Users.objects.using(alias).select_for_update().get(pk=user.pk)
+            if transaction_type == 'BUY':
+                if locked.balance < price:
+                    raise TradeRejected("Insufficient balance")
+                locked.balance -= price
+
+            elif transaction_type == 'SELL':
+                locked.balance += price
+
+            locked.save(update_fields=['balance'])
+            trade = Transaction.objects.create(
+                user=locked,
+                ticker=stock,
+                transaction_type=transaction_type,
+                transaction_volume=volume,
+                transaction_price=price,
+                idempotency_key=idempotency_key,
+            )
+            if transaction_type == 'BUY':
+                ledger.debit(locked, price, transaction_type, transaction=trade)
+            else:
+                ledger.credit(locked, price, transaction_type, transaction=trade)
+            transaction.on_commit(lambda: risk_engine.record(trade, reservation), using=alias)
+    except BaseException:
+        # Rolled back: the held amounts no longer count against the user's limits.
+        risk_engine.release(reservation)
+        raise
+    user.balance = locked.balance
+    return trade
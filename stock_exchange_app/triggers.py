@@ -0,0 +1,207 @@
+"""
+Trigger engine for conditional (stop-loss / take-profit) orders.
+
+Resting orders are indexed per ticker in two heaps: a min-heap of trigger
+prices that fire when the price rises to them and a max-heap of trigger prices
+that fire when the price falls to them. A price update pops only the crossed
+orders, so firing k of n resting orders costs O(k log n) instead of a scan.
+
+The engine is fed by the price feed (see PRICE_FLUSH_LISTENERS) after each
+flush, and every fired order goes through trading.execute_trade.
+"""
+import heapq
+import logging
+import threading
+import time
+from collections import defaultdict, namedtuple
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import ConditionalOrder
+from .sharding import shard_databases, shard_for_username
+from .trading import TradeRejected, execute_trade
+
+logger = logging.getLogger(__name__)
+
+_engine = None
+_engine_lock = threading.Lock()
+
+# Index payload of a resting order: enough to re-index it and to find its shard when it fires.
+RestingOrder = namedtuple('RestingOrder', ['username', 'ticker', 'direction', 'trigger_price'])
+
+
+class TriggerIndex:
+    """
+    Per-ticker heaps of resting trigger prices, keyed by order id.
+    """
+
+    def __init__(self):
+        self._above = defaultdict(list)
+        self._below = defaultdict(list)
+        self._resting = {}
+
+    def __len__(self):
+        return len(self._resting)
+
+    def __contains__(self, order_id):
+        return order_id in self._resting
+
+    def add(self, order_id, ticker, direction, trigger_price, payload=None):
+        """
+        Index an order. `payload` is returned alongside the id when the order fires.
+        """
+        if order_id in self._resting:
+            return
+        self._resting[order_id] = payload
+        if direction == ConditionalOrder.ABOVE:
+            heapq.heappush(self._above[ticker], (trigger_price, order_id))
+        else:
+            heapq.heappush(self._below[ticker], (-trigger_price, order_id))
+
+    def discard(self, order_id):
+        """
+        Forget an order; its heap entry is skipped lazily when reached.
+        """
+        self._resting.pop(order_id, None)
+
+    def crossed(self, ticker, price):
+        """
+        Remove and return [(order_id, payload)] for every order on `ticker` crossed by `price`.
+        """
+        fired = []
+        above = self._above.get(ticker)
+        while above and above[0][0] <= price:
+            _, order_id = heapq.heappop(above)
+            if order_id in self._resting:
+                fired.append((order_id, self._resting.pop(order_id)))
+
+        below = self._below.get(ticker)
+        while below and -below[0][0] >= price:
+            _, order_id = heapq.heappop(below)
+            if order_id in self._resting:
+                fired.append((order_id, self._resting.pop(order_id)))
+        return fired
+
+
+class TriggerEngine:
+    """
+    Keeps the TriggerIndex in sync with pending ConditionalOrder rows and executes crossed orders.
+
+    Orders created by other processes are picked up by polling for recent pending
+    orders at most every TRIGGER_REFRESH_INTERVAL seconds.
+    """
+
+    def __init__(self):
+        self.index = TriggerIndex()
+        self._lock = threading.RLock()
+        self._loaded_since = None
+        self._last_refresh = None
+
+    def refresh(self, force=False):
+        """
+        Load pending orders created since the last refresh (all of them on the first call).
+        """
+        with self._lock:
+            now = time.monotonic()
+            if not force and self._last_refresh is not None \
+                    and now - self._last_refresh < settings.TRIGGER_REFRESH_INTERVAL:
+                return
+            started = timezone.now()
+            for alias in shard_databases():
+                orders = ConditionalOrder.objects.using(alias).filter(status=ConditionalOrder.PENDING)
+                if self._loaded_since is not None:
+                    # Overlap a little to cover orders committed out of created_time order.
+                    orders = orders.filter(created_time__gte=self._loaded_since - timedelta(seconds=5))
+                rows = orders.values_list('pk', 'user__username', 'ticker__ticker', 'direction', 'trigger_price')
+                for order_id, *resting in rows.iterator(chunk_size=10000):
+                    self._index(order_id, RestingOrder(*resting))
+            self._loaded_since = started
+            self._last_refresh = now
+
+    def add(self, order):
+        """
+        Index a newly created order if this process already holds the index.
+        """
+        with self._lock:
+            if self._loaded_since is not None:
+                self._index(order.pk, RestingOrder(
+                    order.user.username, order.ticker.ticker, order.direction, order.trigger_price
+                ))
+
+    def _index(self, order_id, resting):
+        self.index.add(order_id, resting.ticker, resting.direction, resting.trigger_price, resting)
+
+    def on_prices(self, prices):
+        """
+        Fire every resting order crossed by the new {ticker: price} values.
+        """
+        with self._lock:
+            self.refresh()
+            fired = []
+            for ticker, price in prices.items():
+                fired.extend(self.index.crossed(ticker, price))
+
+        for order_id, resting in fired:
+            try:
+                self.fire(order_id, resting.username)
+            except Exception:
+                logger.exception("Conditional order %s failed to execute", order_id)
+                # Still pending: put it back so a later price update retries it.
+                with self._lock:
+                    self._index(order_id, resting)
+
+    def fire(self, order_id, username):
+        """
+        Execute one triggered order unless it is no longer pending.
+
+        The order is looked up on the shard its user hashes to now, falling back to
+        the others while `rebalance_shards` has not moved it yet.
+        """
+        home = shard_for_username(username)
+        for alias in [home] + [alias for alias in shard_databases() if alias != home]:
+            with transaction.atomic(using=alias):
+                order = (
+                    ConditionalOrder.objects.using(alias)
+                    .select_for_update()
+                    .select_related('user', 'ticker')
+                    .filter(pk=order_id)
+                    .first()
+                )
+                if order is None:
+                    continue
+                if order.status != ConditionalOrder.PENDING:
+                    return None
+                return self._execute(order)
+        return None
+
+    def _execute(self, order):
+        try:
+            order.transaction = execute_trade(
+                order.user, order.ticker, order.transaction_type, order.transaction_volume
+            )
+            order.status = ConditionalOrder.FILLED
+        except TradeRejected as e:
+            order.status = ConditionalOrder.REJECTED
+            order.status_reason = str(e)
+        order.triggered_time = timezone.now()
+        order.save(update_fields=['transaction', 'status', 'status_reason', 'triggered_time'])
+        return order
+
+
+def get_engine():
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                _engine = TriggerEngine()
+    return _engine
+
+
+def on_prices(prices):
+    """
+    Price flush listener (see PRICE_FLUSH_LISTENERS).
+    """
+    get_engine().on_prices(prices)
@@ -9,7 +9,12 @@ from .views import (
     ListUserTransactionsView,
     ListTransactionsByTimestampView,
     GetUserView,
+    GetUserBalanceAtView,
     GetStockView,
+    IngestPricesView,
+    PriceFeedMetricsView,
+    CreateConditionalOrderView,
+    ListConditionalOrdersView,
 )
 
 urlpatterns = [
@@ -17,9 +22,14 @@ urlpatterns = [
     path('login/', LoginView.as_view(), name='create_user'),
     path('users/', CreateUserView.as_view(), name='create_user'),
     path('users/<str:username>/', GetUserView.as_view(), name='get_user'),
+    path('users/<str:username>/balance/<str:timestamp>/', GetUserBalanceAtView.as_view(), name='get_user_balance_at'),
     path('create_stock', CreateStockView.as_view(), name='create_stock'),
     path('stocks/', ListStocksView.as_view(), name='list_stocks'),
     path('stocks/<str:ticker>/', GetStockView.as_view(), name='get_stock'),
+    path('prices/', IngestPricesView.as_view(), name='ingest_prices'),
+    path('prices/metrics/', PriceFeedMetricsView.as_view(), name='price_feed_metrics'),
+    path('conditional_orders/', CreateConditionalOrderView.as_view(), name='create_conditional_order'),
+    path('conditional_orders/<str:username>/', ListConditionalOrdersView.as_view(), name='list_conditional_orders'),
     path('transactions/', CreateTransactionView.as_view(), name='create_transaction'),
     path('transactions/<str:username>/', ListUserTransactionsView.as_view(), name='list_user_transactions'),
     path('transactions/<str:username>/<str:start_time>/<str:end_time>/', ListTransactionsByTimestampView.as_view(), name='Transaction_with_timestamp'),
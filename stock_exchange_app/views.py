@@ -1,5 +1,6 @@
 from django.contrib.auth import authenticate
 from django.contrib.auth.hashers import make_password
+from django.db import transaction
 from django.shortcuts import get_object_or_404
 from django.utils.dateparse import parse_datetime
 from django.utils.decorators import method_decorator
@@ -7,14 +8,19 @@ from drf_yasg.utils import swagger_auto_schema
 from rest_framework.decorators import permission_classes
 from rest_framework.permissions import AllowAny
 from rest_framework.status import HTTP_401_UNAUTHORIZED
+from . import ledger, pricefeed, triggers
 from .authentication import Generate_JWT_token, JWT_Required
-from .models import Users, Stocks, Transaction
+from .idempotency import idempotent
+from .models import Users, Stocks, Transaction, LedgerEntry, ConditionalOrder
+from .querybudget import query_budget
+from .sharding import shard_for_username
+from .trading import IdempotencyKeyReused, TradeRejected, execute_trade
 from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
 from django.contrib.auth.models import User
 from rest_framework import status
 from rest_framework.views import APIView
-from stock_exchange_app.serializer import UserSerializer, StockSerializer, TransactionSerializer, RegisterSerializer, LoginSerializer
+from stock_exchange_app.serializer import UserSerializer, StockSerializer, TransactionSerializer, RegisterSerializer, LoginSerializer, PriceTickSerializer, ConditionalOrderSerializer
 
 
 class RegisterView(APIView):
@@ -26,6 +32,7 @@ class RegisterView(APIView):
     hashes the password, creates a user, and returns a JWT token.
     """
 
+    @query_budget(3)
     @permission_classes([AllowAny])
     @swagger_auto_schema(request_body=RegisterSerializer)
     def post(self, request):
@@ -59,6 +66,7 @@ class LoginView(APIView):
     Authenticates the user with username and password, and returns a JWT token.
     """
 
+    @query_budget(1)
     @permission_classes([AllowAny])
     @swagger_auto_schema(request_body=LoginSerializer)
     def post(self, request):
@@ -83,16 +91,20 @@ class CreateUserView(APIView):
     Creates a new user. Requires JWT authentication.
 
     POST:
-    Creates a new user with balance information.
+    Creates a new user with balance information and records the initial funding in the ledger.
     """
 
+    @query_budget(6, per_shard=1)
     @method_decorator(JWT_Required)
     @swagger_auto_schema(request_body=UserSerializer)
     def post(self, request):
         serializer = UserSerializer(data=request.data)
         try:
             if serializer.is_valid(raise_exception=True):
-                serializer.save()
+                username = serializer.validated_data['username']
+                with transaction.atomic(using=shard_for_username(username)):
+                    user = serializer.save()
+                    ledger.credit(user, user.balance, LedgerEntry.FUNDING)
                 return Response(serializer.data, status=status.HTTP_201_CREATED)
         except ValidationError as e:
             return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
@@ -106,6 +118,7 @@ class GetUserView(APIView):
     Returns the user information including balance.
     """
 
+    @query_budget(0, per_shard=1)
     @permission_classes([AllowAny])
     @swagger_auto_schema()
     def get(self, request, username):
@@ -122,6 +135,7 @@ class CreateStockView(APIView):
     Creates a new stock with ticker, stock price, and stock name.
     """
 
+    @query_budget(3, per_shard=5)
     @method_decorator(JWT_Required)
     @swagger_auto_schema(request_body=StockSerializer)
     def post(self, request):
@@ -142,6 +156,7 @@ class ListStocksView(APIView):
     Returns a list of all stocks.
     """
 
+    @query_budget(1)
     @permission_classes([AllowAny])
     @swagger_auto_schema()
     def get(self, request):
@@ -158,6 +173,7 @@ class GetStockView(APIView):
     Returns the stock information by ticker.
     """
 
+    @query_budget(1)
     @permission_classes([AllowAny])
     @swagger_auto_schema()
     def get(self, request, ticker):
@@ -166,15 +182,62 @@ class GetStockView(APIView):
         return Response(serializer.data, status=status.HTTP_200_OK)
 
 
+class IngestPricesView(APIView):
+    """
+    Ingests a batch of price ticks. Requires JWT authentication.
+
+    POST:
+    Buffers the latest price per ticker in memory; prices are written to the
+    database in bulk on the next flush interval.
+    """
+
+    @query_budget(1)
+    @method_decorator(JWT_Required)
+    @swagger_auto_schema(request_body=PriceTickSerializer(many=True))
+    def post(self, request):
+        ticks = request.data
+        if not isinstance(ticks, list):
+            return Response({"error": "Expected a list of price ticks"}, status=status.HTTP_400_BAD_REQUEST)
+
+        price_buffer = pricefeed.get_buffer()
+        counts = {pricefeed.ACCEPTED: 0, pricefeed.MERGED: 0, pricefeed.DROPPED: 0}
+        for tick in ticks:
+            if isinstance(tick, dict):
+                result = price_buffer.submit(tick.get('ticker'), tick.get('stock_price'))
+            else:
+                result = price_buffer.submit(None, None)
+            counts[result] += 1
+        return Response(counts, status=status.HTTP_202_ACCEPTED)
+
+
+class PriceFeedMetricsView(APIView):
+    """
+    Reports price ingestion metrics.
+
+    GET:
+    Returns tick counters (received, merged, dropped) and flush lag.
+    """
+
+    @query_budget(0)
+    @permission_classes([AllowAny])
+    @swagger_auto_schema()
+    def get(self, request):
+        return Response(pricefeed.get_buffer().metrics(), status=status.HTTP_200_OK)
+
+
 class CreateTransactionView(APIView):
     """
     Creates a new transaction for buying or selling stocks. Requires JWT authentication.
 
     POST:
-    Creates a transaction, checks for balance in case of buy, updates user balance accordingly.
+    Creates a transaction, checks for balance in case of buy, updates user balance accordingly
+    and records the debit or credit in the ledger. Retries sent with the same Idempotency-Key
+    header get the first response back instead of placing the trade again.
     """
 
+    @query_budget(20, per_shard=1)
     @method_decorator(JWT_Required)
+    @method_decorator(idempotent)
     @swagger_auto_schema(request_body=TransactionSerializer)
     def post(self, request):
         serializer = TransactionSerializer(data=request.data)
@@ -184,19 +247,16 @@ class CreateTransactionView(APIView):
                 stock = serializer.validated_data['ticker']
                 transaction_type = serializer.validated_data['transaction_type']
                 volume = serializer.validated_data['transaction_volume']
-                price = stock.stock_price * volume
-
-                if transaction_type == 'BUY':
-                    if user.balance < price:
-                        return Response({"error": "Insufficient balance"}, status=status.HTTP_400_BAD_REQUEST)
-                    user.balance -= price
 
-                elif transaction_type == 'SELL':
-                    user.balance += price
-
-                user.save()
-                serializer.save(transaction_price=price)
-                return Response(serializer.data, status=status.HTTP_201_CREATED)
+                try:
+                    trade = execute_trade(user, stock, transaction_type, volume,
+                                          idempotency_key=getattr(request, 'idempotency_key', None))
+                except TradeRejected as e:
+                    return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+                except IdempotencyKeyReused as e:
+                    return Response({"error": str(e)}, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+                request.idempotent_write = True
+                return Response(TransactionSerializer(trade).data, status=status.HTTP_201_CREATED)
         except ValidationError as e:
             return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
         except Exception as e:
@@ -204,6 +264,47 @@ class CreateTransactionView(APIView):
                             status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
+class CreateConditionalOrderView(APIView):
+    """
+    Creates a stop-loss or take-profit order. Requires JWT authentication.
+
+    POST:
+    Stores a pending order that is executed like a regular transaction once the
+    stock price crosses its trigger price.
+    """
+
+    @query_budget(3, per_shard=1)
+    @method_decorator(JWT_Required)
+    @swagger_auto_schema(request_body=ConditionalOrderSerializer)
+    def post(self, request):
+        serializer = ConditionalOrderSerializer(data=request.data)
+        try:
+            if serializer.is_valid(raise_exception=True):
+                order = serializer.save()
+                triggers.get_engine().add(order)
+                return Response(serializer.data, status=status.HTTP_201_CREATED)
+        except ValidationError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+
+class ListConditionalOrdersView(APIView):
+    """
+    Lists all conditional orders for a specific user.
+
+    GET:
+    Returns the user's conditional orders with their current status.
+    """
+
+    @query_budget(1, per_shard=1)
+    @permission_classes([AllowAny])
+    @swagger_auto_schema()
+    def get(self, request, username):
+        user = get_object_or_404(Users, username=username)
+        orders = ConditionalOrder.objects.filter(user=user)
+        serializer = ConditionalOrderSerializer(orders, many=True)
+        return Response(serializer.data, status=status.HTTP_200_OK)
+
+
 class ListUserTransactionsView(APIView):
     """
     Lists all transactions for a specific user.
@@ -212,11 +313,12 @@ class ListUserTransactionsView(APIView):
     Returns all transactions performed by the specified user.
     """
 
+    @query_budget(1, per_shard=1)
     @permission_classes([AllowAny])
     @swagger_auto_schema()
     def get(self, request, username):
         user = get_object_or_404(Users, username=username)
-        transactions = Transaction.objects.filter(user=user)
+        transactions = Transaction.objects.filter(user=user).select_related('user', 'ticker')
         serializer = TransactionSerializer(transactions, many=True)
         return Response(serializer.data, status=status.HTTP_200_OK)
 
@@ -229,6 +331,7 @@ class ListTransactionsByTimestampView(APIView):
     Returns transactions by username, filtered by start and end timestamp.
     """
 
+    @query_budget(1, per_shard=1)
     @permission_classes([AllowAny])
     @swagger_auto_schema()
     def get(self, request, username, start_time, end_time):
@@ -243,6 +346,28 @@ class ListTransactionsByTimestampView(APIView):
         transactions = Transaction.objects.filter(
             user=user,
             created_time__range=[start_timestamp, end_timestamp]
-        )
+        ).select_related('user', 'ticker')
         serializer = TransactionSerializer(transactions, many=True)
         return Response(serializer.data, status=status.HTTP_200_OK)
+
+
+class GetUserBalanceAtView(APIView):
+    """
+    Retrieves a user's ledger balance at a point in time.
+
+    GET:
+    Returns the balance computed from the nearest ledger snapshot plus the entries after it.
+    """
+
+    @query_budget(2, per_shard=1)
+    @permission_classes([AllowAny])
+    @swagger_auto_schema()
+    def get(self, request, username, timestamp):
+        user = get_object_or_404(Users, username=username)
+
+        at = parse_datetime(timestamp)
+        if not at:
+            return Response({"error": "Invalid date format"}, status=status.HTTP_400_BAD_REQUEST)
+
+        balance = ledger.balance_at(user, at)
+        return Response({"username": user.username, "timestamp": at, "balance": balance}, status=status.HTTP_200_OK)